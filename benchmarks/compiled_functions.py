@@ -0,0 +1,81 @@
+# Tree-walking f_interp vs. compiled function fields on multiplication.jsonx-style arithmetic.
+# Run from the repository root: python -m benchmarks.compiled_functions [iterations]
+import io
+import sys
+import time
+
+import jsonx
+
+
+TEMPLATE = """{
+    "myfunc":->{
+        var myvar1 = 2*5;
+        var myvar2 = 5;
+        return myvar1*myvar2;
+    },
+    "number":->{
+        var myvar = 2*5+60+100*2+5*5+10; return myvar;
+    },
+    "product":->{
+        var a = 3*7+2*5+1;
+        var b = 4*6+8*2+1*9;
+        return a*b;
+    },
+    "pair":->{
+        var pair = [21,10];
+        return pair + [{"sum":31}];
+    }
+}"""
+# literals in function bodies are parsed as JSON text, a result of null here means they were dropped
+EXPECTED = [50,305,1568,[21,10,{"sum":31}]]
+
+
+class NullWriter(io.TextIOBase):
+    def write(self,text):
+        return len(text)
+
+
+def parse(text):
+    tokens,error = jsonx.make_tokens(text)
+    if error:
+        raise error
+    return jsonx.Parser(tokens,text).parse()
+
+
+def time_functions(interpreter,run,functions,iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for func_node in functions:
+            run(func_node,None)
+    return time.perf_counter() - start
+
+
+def main(iterations=2000):
+    ast = parse(TEMPLATE)
+    functions = list(ast.values)
+    interpreter = jsonx.Interpreter(ast)
+
+    walked = [interpreter.walk_function(func_node,None) for func_node in functions]
+    if walked != EXPECTED:
+        raise Exception("Tree-walker results {} differ from expected results {}".format(walked,EXPECTED))
+    walk_time = time_functions(interpreter,interpreter.walk_function,functions,iterations)
+
+    compile_start = time.perf_counter()
+    compiled = {id(func_node): interpreter.compile_function(func_node) for func_node in functions}
+    compile_time = time.perf_counter() - compile_start
+    run_compiled = lambda func_node,this: compiled[id(func_node)](interpreter,this)
+
+    results = [run_compiled(func_node,None) for func_node in functions]
+    if results != walked:
+        raise Exception("Compiled results {} differ from tree-walker results {}".format(results,walked))
+    compiled_time = time_functions(interpreter,run_compiled,functions,iterations)
+
+    calls = iterations * len(functions)
+    print("function calls:    {}".format(calls))
+    print("tree-walker:       {:.4f}s ({:.1f} us/call)".format(walk_time,walk_time/calls*1e6))
+    print("compiled:          {:.4f}s ({:.1f} us/call, compile {:.1f} us)".format(compiled_time,compiled_time/calls*1e6,compile_time*1e6))
+    print("speedup:           {:.1f}x".format(walk_time/compiled_time))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:2]])
@@ -0,0 +1,69 @@
+# A compiled template applied to JSON Lines records, against building and executing one document per record.
+# Run from the repository root: python -m benchmarks.jsonl_template [records]
+import io
+import json
+import random
+import sys
+import time
+
+import jsonx
+
+
+TEMPLATE = """{
+    "fullName":->{
+        return this.first + " " + this.last;
+    },
+    "adult":->{
+        return this.age >= 18;
+    },
+    "label":->{
+        return this.fullName + " (" + this.age + ")";
+    },
+    "source":"benchmark"
+}"""
+
+
+def records(count,seed=0):
+    generator = random.Random(seed)
+    lines = []
+    for index in range(count):
+        lines.append(json.dumps({"id": index, "first": "First{}".format(index), "last": "Last", "age": generator.randint(1,90)}))
+    return "\n".join(lines) + "\n"
+
+
+def per_document(lines):
+    # what a record took before templates: its fields and the template's fields as one document
+    output = []
+    members = TEMPLATE.strip()[1:-1]
+    for line in lines.splitlines():
+        record = json.loads(line)
+        fields = ",".join("{}:{}".format(json.dumps(name),json.dumps(value)) for name,value in record.items())
+        output.append(jsonx.dumps(jsonx.loads("{" + fields + "," + members + "}")))
+    return output
+
+
+def main(count=50000):
+    lines = records(count)
+    template = jsonx.Template(TEMPLATE)
+
+    output = io.StringIO()
+    start = time.perf_counter()
+    template.run(io.StringIO(lines),output)
+    template_time = time.perf_counter() - start
+
+    # the per-document path is much slower, a tenth of the records is enough to time it
+    sample = "".join(lines.splitlines(True)[:max(1,count // 10)])
+    start = time.perf_counter()
+    expected = per_document(sample)
+    document_time = (time.perf_counter() - start) * count / len(expected)
+
+    if output.getvalue().splitlines()[:len(expected)] != expected:
+        raise Exception("Template output differs from per-document output")
+    print("records:           {}".format(count))
+    print("template:          {:.4f}s ({:.0f} records/s)".format(template_time,count/template_time))
+    print("per document:      {:.4f}s ({:.0f} records/s, estimated from {} records)".format(document_time,count/document_time,len(expected)))
+    print("speedup:           {:.1f}x".format(document_time/template_time))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:2]])
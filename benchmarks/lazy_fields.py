@@ -0,0 +1,40 @@
+# Reading a few fields of a document with many function fields, lazily against evaluating all of it.
+# Run from the repository root: python -m benchmarks.lazy_fields [fields] [iterations]
+import sys
+import time
+
+import jsonx
+
+
+FIELD = '    "total{index}":->{{return for i in {size} {{ i * {index} }};}}'
+
+
+def document(fields,size=200):
+    members = ['    "name":"Robert"'] + [FIELD.format(index=index,size=size) for index in range(fields)]
+    return "{\n" + ",\n".join(members) + "\n}"
+
+
+def time_reads(text,lazy,names,iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = jsonx.loads(text,optimize=False,lazy=lazy)
+        values = [result[name] for name in names]
+    return time.perf_counter() - start,values
+
+
+def main(fields=500,iterations=20):
+    text = document(fields)
+    names = ["name","total0","total{}".format(fields-1)]
+
+    eager_time,eager_values = time_reads(text,False,names,iterations)
+    lazy_time,lazy_values = time_reads(text,True,names,iterations)
+    if lazy_values != eager_values:
+        raise Exception("Lazy values differ from eager values")
+    print("function fields:   {}, {} read".format(fields,len(names)-1))
+    print("eager:             {:.4f}s ({:.2f} ms/document)".format(eager_time,eager_time/iterations*1e3))
+    print("lazy:              {:.4f}s ({:.2f} ms/document)".format(lazy_time,lazy_time/iterations*1e3))
+    print("speedup:           {:.1f}x".format(eager_time/lazy_time))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:3]])
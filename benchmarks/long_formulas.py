@@ -0,0 +1,45 @@
+# Parse and evaluation time of generated formulas as they grow; the time per term should stay flat.
+# Run from the repository root: python -m benchmarks.long_formulas [terms]
+import random
+import sys
+import time
+
+import jsonx
+
+
+def formula(terms,seed=0):
+    generator = random.Random(seed)
+    parts = [str(generator.randint(1,9))]
+    for index in range(1,terms):
+        operator = generator.choice("+-*")
+        operand = str(generator.randint(1,9))
+        if index % 7 == 0:
+            operand = "(" + operand + "-" + str(generator.randint(1,9)) + ")"
+        parts.append(operator + operand)
+    return "".join(parts)
+
+
+def template(terms):
+    return '{\n    "value":->{\n        return ' + formula(terms) + ';\n    }\n}'
+
+
+def main(terms=16000):
+    sizes = []
+    size = 1000
+    while size <= terms:
+        sizes.append(size)
+        size *= 4
+
+    print("{:>8} {:>10} {:>10} {:>12}".format("terms","parse s","eval s","us/term"))
+    for size in sizes:
+        text = template(size)
+        start = time.perf_counter()
+        ast = jsonx.parse_text(text)
+        parsed = time.perf_counter()
+        jsonx.Interpreter(ast).evaluate()
+        evaluated = time.perf_counter()
+        print("{:>8} {:>10.4f} {:>10.4f} {:>12.2f}".format(size,parsed-start,evaluated-parsed,(evaluated-start)/size*1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:2]])
@@ -0,0 +1,33 @@
+# One value selected out of a large keyed map, against evaluating the whole document.
+# Run from the repository root: python -m benchmarks.select_path [entries]
+import sys
+import time
+
+import jsonx
+from benchmarks.workloads import keyed_map
+
+
+def main(entries=100000):
+    text = keyed_map(entries)
+    selections = ["data.y1895.value","first","title","data.y{}.anomaly".format(1895+entries-1)]
+
+    start = time.perf_counter()
+    document = jsonx.loads(text)
+    full_time = time.perf_counter() - start
+
+    print("document:               {:.1f} MB, {} entries".format(len(text)/1e6,entries))
+    print("whole document:         {:.4f}s".format(full_time))
+    for selection in selections:
+        start = time.perf_counter()
+        value = jsonx.loads(text,select=selection)
+        elapsed = time.perf_counter() - start
+        expected = document
+        for key in jsonx.parse_select(selection):
+            expected = expected[key]
+        if value != expected:
+            raise Exception("Selected value of {} differs from the whole document".format(selection))
+        print("{:<24}{:.4f}s ({:.0f}x)".format(selection + ":",elapsed,full_time/elapsed))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:2]])
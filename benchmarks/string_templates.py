@@ -0,0 +1,56 @@
+# String concatenation templates in the style of example/name.jsonx, whole documents per iteration.
+# Run from the repository root: python -m benchmarks.string_templates [iterations] [fields]
+import sys
+import time
+
+import jsonx
+from benchmarks.compiled_functions import NullWriter, parse
+
+
+FIELD = """    "name{index}":->{{
+        return this.firstName + " Dawney Jr. {index}";
+    }},
+    "greeting{index}":->{{
+        var name = this.firstName + " the {index}th";
+        return name;
+    }},
+    "age{index}":->{{
+        return this.age + " years";
+    }}"""
+
+
+def template(fields):
+    members = ['    "firstName":"Robert"','    "age":30'] + [FIELD.format(index=index) for index in range(fields)]
+    return "{\n" + ",\n".join(members) + "\n}"
+
+
+def time_documents(ast,compiled,iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        jsonx.Interpreter(ast,compiled).execute(NullWriter())
+    return time.perf_counter() - start
+
+
+def main(iterations=200,fields=50):
+    text = template(fields)
+    ast = parse(text)
+    concatenations = fields * 3
+
+    walked = jsonx.Interpreter(ast,False).execute()
+    walk_time = time_documents(ast,False,iterations)
+
+    rendered = jsonx.Interpreter(ast).execute()
+    if rendered != walked:
+        raise Exception("Compiled output differs from tree-walker output")
+    compiled_time = time_documents(ast,True,iterations)
+
+    calls = iterations * concatenations
+    print("document:          {} bytes in, {} bytes out".format(len(text),len(rendered)))
+    print("concatenations:    {}".format(calls))
+    print("tree-walker:       {:.4f}s ({:.2f} us/concat)".format(walk_time,walk_time/calls*1e6))
+    print("compiled:          {:.4f}s ({:.2f} us/concat)".format(compiled_time,compiled_time/calls*1e6))
+    print("speedup:           {:.1f}x".format(walk_time/compiled_time))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:3]])
@@ -0,0 +1,198 @@
+# Times the lexer, parser and interpreter on the synthetic workloads and compares with a stored baseline.
+# Run from the repository root: python -m benchmarks.suite [--update-baseline] [--scale 0.5] [workload ...]
+# Exits with status 1 when a stage got slower than the baseline by more than the tolerance.
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import jsonx
+from benchmarks.compiled_functions import NullWriter
+from benchmarks.workloads import WORKLOADS
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),"baseline.json")
+STAGES = ("lex","parse","interpret","total")
+DEFAULT_TOLERANCE = 0.5
+
+
+def calibration_loop(loops=200000):
+    total = 0
+    for index in range(loops):
+        total += index % 7
+    return total
+
+
+def calibrate(repeat=5):
+    # a fixed amount of pure Python work, so baselines from a faster or slower machine still compare
+    return best_of(repeat,calibration_loop)[0]
+
+
+def best_of(repeat,function):
+    best = None
+    for _ in range(repeat):
+        # like timeit, collections are kept out of the measured time
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best,result
+
+
+def count_nodes(root):
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        count += 1
+        node_type = type(node)
+        if node_type == jsonx.ObjectNode:
+            # a member counts as a node of its own, as it did when members were NameValuePairNode objects
+            count += len(node.values)
+            stack.extend(node.values)
+        elif node_type == jsonx.ArrayNode:
+            stack.extend(node.object_nodes)
+        elif node_type == jsonx.FuncDefNode:
+            stack.extend(node.body_node)
+        else:
+            for attribute in jsonx.FUNCTION_CHILD_ATTRIBUTES:
+                child = getattr(node,attribute,None)
+                if child is not None and type(child) not in (str,int,jsonx.Token):
+                    stack.append(child)
+    return count
+
+
+def peak_memory(text):
+    tracemalloc.start()
+    try:
+        jsonx.Interpreter(jsonx.parse_text(text,optimize=True)).execute(NullWriter())
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_workload(name,text,repeat):
+    megabytes = len(text.encode("utf-8")) / 1e6
+    # measured next to every workload, the machine's speed drifts during a long run
+    calibration = calibrate()
+
+    lex_time,(tokens,error) = best_of(repeat,lambda: jsonx.make_tokens(text))
+    if error:
+        raise error
+    # the stage timings build the whole tree; only total takes the plain JSON passthrough
+    parse_time,ast = best_of(repeat,lambda: jsonx.Parser(tokens).parse())
+    interpret_time,_ = best_of(repeat,lambda: jsonx.Interpreter(ast).execute(NullWriter()))
+    total_time,_ = best_of(repeat,lambda: jsonx.Interpreter(jsonx.parse_text(text,optimize=True)).execute(NullWriter()))
+    nodes = count_nodes(ast)
+
+    return {
+        "calibration": calibration,
+        "bytes": len(text),
+        "tokens": len(tokens),
+        "nodes": nodes,
+        "seconds": {"lex": lex_time, "parse": parse_time, "interpret": interpret_time, "total": total_time},
+        "mb_per_s": megabytes / total_time,
+        "tokens_per_s": len(tokens) / lex_time,
+        "nodes_per_s": nodes / parse_time,
+        "peak_bytes": peak_memory(text),
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+
+def compare(results,baseline,tolerance):
+    regressions = []
+    for name,result in results.items():
+        previous = baseline["workloads"].get(name)
+        if previous is None:
+            continue
+        for stage in STAGES:
+            # both sides are measured in units of their own calibration loop
+            now = result["seconds"][stage] / result["calibration"]
+            before = previous["seconds"][stage] / previous["calibration"]
+            ratio = now / before
+            if ratio > 1 + tolerance:
+                regressions.append("{} {}: {:.2f}x slower than the baseline".format(name,stage,ratio))
+        if result["peak_bytes"] > previous["peak_bytes"] * (1 + tolerance):
+            regressions.append("{} peak memory: {:.1f} MB, baseline {:.1f} MB".format(name,result["peak_bytes"]/1e6,previous["peak_bytes"]/1e6))
+    return regressions
+
+
+def print_results(results):
+    print("{:<16} {:>9} {:>9} {:>9} {:>9} {:>8} {:>11} {:>10} {:>9}".format(
+        "workload","lex s","parse s","interp s","total s","MB/s","tokens/s","nodes/s","peak MB"))
+    for name,result in results.items():
+        seconds = result["seconds"]
+        print("{:<16} {:>9.4f} {:>9.4f} {:>9.4f} {:>9.4f} {:>8.2f} {:>11.0f} {:>10.0f} {:>9.1f}".format(
+            name,seconds["lex"],seconds["parse"],seconds["interpret"],seconds["total"],
+            result["mb_per_s"],result["tokens_per_s"],result["nodes_per_s"],result["peak_bytes"]/1e6))
+
+
+def main(argv=None):
+    argument_parser = argparse.ArgumentParser(prog="benchmarks.suite",description="Benchmark jsonx on synthetic workloads.")
+    argument_parser.add_argument("workloads",nargs="*",help="workloads to run, from {} (default: all)".format(", ".join(WORKLOADS)))
+    argument_parser.add_argument("--repeat",type=int,default=5,help="runs per stage, the fastest one counts")
+    argument_parser.add_argument("--scale",type=float,default=1.0,help="multiplies the default size of every workload")
+    argument_parser.add_argument("--baseline",default=BASELINE_PATH)
+    argument_parser.add_argument("--update-baseline",action="store_true",help="store these results as the new baseline")
+    argument_parser.add_argument("--tolerance",type=float,default=DEFAULT_TOLERANCE,help="allowed slowdown before a stage counts as a regression")
+    arguments = argument_parser.parse_args(argv)
+
+    names = arguments.workloads or list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        argument_parser.error("unknown workloads: {}".format(", ".join(unknown)))
+    results = {}
+    for name in names:
+        generator = WORKLOADS[name]
+        size = max(1,int(generator.__defaults__[0] * arguments.scale))
+        results[name] = run_workload(name,generator(size),arguments.repeat)
+    print_results(results)
+
+    if arguments.update_baseline:
+        baseline = load_baseline(arguments.baseline) or {"workloads": {}}
+        baseline["scale"] = arguments.scale
+        baseline["workloads"].update(results)
+        with open(arguments.baseline,"w") as baseline_file:
+            json.dump(baseline,baseline_file,indent=2,sort_keys=True)
+            baseline_file.write("\n")
+        print("baseline written to {}".format(arguments.baseline))
+        return 0
+
+    baseline = load_baseline(arguments.baseline)
+    if baseline is None:
+        print("no baseline at {}, run with --update-baseline to create one".format(arguments.baseline))
+        return 0
+    if baseline.get("scale") != arguments.scale:
+        print("baseline was recorded with --scale {}, not comparing".format(baseline.get("scale")))
+        return 0
+
+    regressions = compare(results,baseline,arguments.tolerance)
+    if regressions:
+        print("REGRESSIONS against {}:".format(arguments.baseline),file=sys.stderr)
+        for regression in regressions:
+            print("  " + regression,file=sys.stderr)
+        return 1
+    print("no regressions against the baseline (tolerance {:.0%})".format(arguments.tolerance))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+# Synthetic .jsonx documents for the benchmark suite. Every generator takes a size and returns the text.
+import random
+
+from benchmarks.long_formulas import formula
+
+
+def wide_array(elements=20000):
+    items = []
+    for index in range(elements):
+        items.append('{{"id":{0},"name":"item {0}","active":{1},"tags":["a{2}","b{3}"],"parent":null}}'.format(index,"true" if index % 2 else "false",index % 7,index % 11))
+    return "[\n" + ",\n".join(items) + "\n]"
+
+
+def deep_nesting(depth=150):
+    # every level has a function field, so none of it can be passed through as plain JSON
+    text = '{"value":' + str(depth) + ',"double":->{return this.value*2;}}'
+    for level in range(depth-1,-1,-1):
+        text = '{{"level":{0},"child":{1},"label":->{{return "level " + this.level;}}}}'.format(level,text)
+    return text
+
+
+def keyed_map(entries=5000,seed=0):
+    # shaped like example/average-temp.jsonx, with a few fields reading from the map
+    generator = random.Random(seed)
+    rows = []
+    for index in range(entries):
+        rows.append('        "y{}": {{\n            "value": "{:.2f}",\n            "anomaly": "{:.2f}"\n        }}'.format(1895+index,generator.uniform(48,54),generator.uniform(-2,2)))
+    return '''{{
+    "description": {{
+        "title": "Synthetic average temperature",
+        "units": "Degrees Fahrenheit",
+        "base_period": "1901-2000"
+    }},
+    "data": {{
+{}
+    }},
+    "first":->{{return this.data.y1895.value + " F";}},
+    "title":->{{return this.description.title + " (" + this.description.units + ")";}}
+}}'''.format(",\n".join(rows))
+
+
+def chained_this(fields=2000):
+    # every field reads the one before it, so evaluation order follows the whole chain
+    members = ['    "person":{"name":"Robert","age":30}','    "f0":->{return this.person.age;}']
+    for index in range(1,fields):
+        members.append('    "f{}":->{{var previous = this.f{}; return previous + {} * 2;}}'.format(index,index-1,index % 10))
+    members.append('    "summary":->{{return this.person.name + " " + this.f{};}}'.format(fields-1))
+    return "{\n" + ",\n".join(members) + "\n}"
+
+
+def long_arithmetic(terms=20000):
+    return '{\n    "value":->{\n        return ' + formula(terms) + ';\n    }\n}'
+
+
+WORKLOADS = {
+    "wide_array": wide_array,
+    "deep_nesting": deep_nesting,
+    "keyed_map": keyed_map,
+    "chained_this": chained_this,
+    "long_arithmetic": long_arithmetic,
+}
@@ -1,59 +1,247 @@
+import argparse
+import codecs
+import contextlib
+import glob
+import hashlib
+import itertools
 import json
+import mmap
+import os
+import pickle
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from array import array
+from collections import deque
+from collections.abc import Mapping, Sequence
 
 
+__version__ = "0.1.0"
+
 KEYWORDS = ["var","if","else","parent","elif","for","in","step","while","return","break","this","continue","true","false","null"]
 DIGITS = "0123456789"
 LETTERS = "qwertzuiopasdfghjklyxcvbnmQWERTZUIOPASDFGHJKLYXCVBNM"
 LETTERS_WITH_DIGITS = LETTERS + DIGITS
 
+#### TRACING ####
+
+TRACE_DEBUG = 10
+TRACE_INFO = 20
+# phase timing without any events
+TRACE_SILENT = 100
+TRACE_LEVELS = {"debug": TRACE_DEBUG, "info": TRACE_INFO, "silent": TRACE_SILENT}
+TRACE_LEVEL_NAMES = {level: name for name,level in TRACE_LEVELS.items()}
+TRACE_PHASES = ("read","lex","parse","interpret","write")
+
+
+class PhaseTimer:
+    __slots__ = ("tracer","name","start")
+
+    def __init__(self,tracer,name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc_info):
+        self.tracer.add_time(self.name,time.perf_counter() - self.start)
+        return False
+
+
+class Tracer:
+    def __init__(self,level=TRACE_INFO,output=None):
+        self.level = TRACE_LEVELS[level] if type(level) == str else level
+        self.output = output
+        self.phases = {}
+
+    def event(self,level,message,*arguments):
+        if level < self.level:
+            return
+        if arguments:
+            message = message.format(*arguments)
+        output = self.output if self.output is not None else sys.stderr
+        output.write("jsonx {}: {}\n".format(TRACE_LEVEL_NAMES.get(level,level),message))
+
+    def phase(self,name):
+        return PhaseTimer(self,name)
+
+    def phase_entry(self,name):
+        entry = self.phases.get(name)
+        if entry is None:
+            # seconds, calls, items
+            entry = self.phases[name] = [0.0,0,0]
+        return entry
+
+    def add_time(self,name,seconds):
+        entry = self.phase_entry(name)
+        entry[0] += seconds
+        entry[1] += 1
+
+    def count(self,name,items):
+        self.phase_entry(name)[2] += items
+
+    def merge(self,phases):
+        for name,(seconds,calls,items) in phases.items():
+            entry = self.phase_entry(name)
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += items
+
+    def report(self):
+        names = [name for name in TRACE_PHASES if name in self.phases] + sorted(name for name in self.phases if name not in TRACE_PHASES)
+        lines = ["{:<10} {:>10} {:>8} {:>12}".format("phase","seconds","calls","items")]
+        for name in names:
+            seconds,calls,items = self.phases[name]
+            lines.append("{:<10} {:>10.4f} {:>8} {:>12}".format(name,seconds,calls,items))
+        lines.append("{:<10} {:>10.4f}".format("total",sum(entry[0] for entry in self.phases.values())))
+        return lines
+
+
+# None while tracing is disabled, so every trace point costs a single global lookup
+tracer = None
+NO_PHASE = contextlib.nullcontext()
+
+
+def enable_tracing(level=TRACE_INFO,output=None):
+    global tracer
+    tracer = Tracer(level,output)
+    return tracer
+
+
+def disable_tracing():
+    global tracer
+    previous,tracer = tracer,None
+    return previous
+
+
+@contextlib.contextmanager
+def tracing(new_tracer):
+    global tracer
+    previous,tracer = tracer,new_tracer
+    try:
+        yield new_tracer
+    finally:
+        tracer = previous
+
+
+def trace_phase(name):
+    if tracer is None:
+        return NO_PHASE
+    return tracer.phase(name)
+
+
+def trace_count(name,items):
+    if tracer is not None:
+        tracer.count(name,items)
+
+
 #### TOKENS ####
 
-T_INTEGER      = "INT"
-T_FLOAT        = "FLOAT"
-T_STRING       = "STRING"
-T_IDENTIFIER   = "IDENTIFIER"
-T_KEYWORD      = "KEYWORD"
-T_PLUS         = "PLUS"
-T_MINUS        = "MINUS"
-T_ARROW        = "ARROW"
-T_MUL          = "MUL"
-T_DIV          = "DIV"
-T_ASSIGN       = "ASSIGN"
-T_EQUAL        = "EQUAL"
-T_NOT_EQUAL    = "NOT_EQUAL"
-T_LPAREN       = "LPAREN"
-T_RPAREN       = "RPAREN"
-T_LSQUARE      = "LSQUARE"
-T_RSQUARE      = "RSQUARE"
-T_COLON        = "COLON"
-T_LBRACKET     = "LBRACKET"
-T_RBRACKET     = "RBRACKET"
-T_COMMA        = "COMMA"
-T_DOT          = "DOT"
-T_NEWLINE      = "NEWLINE"
-T_ENDOFLINE    = "ENDOFLINE"
-T_LESSER       = "LESSER"
-T_GREATER      = "GREATER"
-T_LESSEREQUAL  = "LESSEREQUAL"
-T_GREATEREQUAL = "GREATEREQUAL"
+T_INTEGER      = 0
+T_FLOAT        = 1
+T_STRING       = 2
+T_IDENTIFIER   = 3
+T_KEYWORD      = 4
+T_PLUS         = 5
+T_MINUS        = 6
+T_ARROW        = 7
+T_MUL          = 8
+T_DIV          = 9
+T_ASSIGN       = 10
+T_EQUAL        = 11
+T_NOT_EQUAL    = 12
+T_LPAREN       = 13
+T_RPAREN       = 14
+T_LSQUARE      = 15
+T_RSQUARE      = 16
+T_COLON        = 17
+T_LBRACKET     = 18
+T_RBRACKET     = 19
+T_COMMA        = 20
+T_DOT          = 21
+T_NEWLINE      = 22
+T_ENDOFLINE    = 23
+T_LESSER       = 24
+T_GREATER      = 25
+T_LESSEREQUAL  = 26
+T_GREATEREQUAL = 27
+
+TOKEN_NAMES = ["INT","FLOAT","STRING","IDENTIFIER","KEYWORD","PLUS","MINUS","ARROW","MUL","DIV","ASSIGN","EQUAL","NOT_EQUAL","LPAREN","RPAREN","LSQUARE","RSQUARE","COLON","LBRACKET","RBRACKET","COMMA","DOT","NEWLINE","ENDOFLINE","LESSER","GREATER","LESSEREQUAL","GREATEREQUAL"]
 
 
 class Token:
+	__slots__ = ("type", "value", "pos_start", "pos_end")
+
 	def __init__(self, type_, value=None, pos_start=None, pos_end=None):
 		self.type = type_
 		self.value = value
+		self.pos_start = pos_start
+		self.pos_end = pos_end
 
-		if pos_start:
-			self.pos_start = pos_start
+		if pos_start is not None and pos_end is None:
 			self.pos_end = pos_start+1
-			
-
-		if pos_end:
-			self.pos_end = pos_end
 	
 	def __repr__(self):
-		if self.value: return f'{self.type}:{self.value}'
-		return f'{self.type}'
+		if self.value: return f'{TOKEN_NAMES[self.type]}:{self.value}'
+		return f'{TOKEN_NAMES[self.type]}'
+
+
+# value id of a string token whose payload is decoded from the bytes source when the token is read
+LAZY_STRING = -2
+# names and strings up to this length are interned, so a key repeated across a document is stored once
+INTERN_MAX_LENGTH = 64
+
+
+class TokenBuffer:
+	__slots__ = ("types", "starts", "ends", "value_ids", "values", "source")
+
+	def __init__(self, text_length=0, source=None):
+		position_typecode = "i" if text_length < 2**31 else "q"
+		self.types = array("b")
+		self.starts = array(position_typecode)
+		self.ends = array(position_typecode)
+		self.value_ids = array("i")
+		self.values = []
+		self.source = source
+
+	def add(self, type_, value=None, pos_start=0, pos_end=0):
+		self.types.append(type_)
+		self.starts.append(pos_start)
+		self.ends.append(pos_end)
+		if value is None:
+			self.value_ids.append(-1)
+		else:
+			self.value_ids.append(len(self.values))
+			self.values.append(value)
+
+	def append(self, token):
+		self.add(token.type, token.value, token.pos_start, token.pos_end)
+
+	def __len__(self):
+		return len(self.types)
+
+	def __getitem__(self, index):
+		value_id = self.value_ids[index]
+		if value_id >= 0:
+			value = self.values[value_id]
+		elif value_id == LAZY_STRING:
+			value = self.source[self.starts[index]+1:self.ends[index]-1].decode("utf-8")
+			if len(value) <= INTERN_MAX_LENGTH:
+				value = sys.intern(value)
+		else:
+			value = None
+		return Token(self.types[index], value, self.starts[index], self.ends[index])
+
+	def __iter__(self):
+		for index in range(len(self.types)):
+			yield self[index]
+
+	def __repr__(self):
+		return f'TokenBuffer({len(self)} tokens)'
 
 
 class Lexer():
@@ -61,7 +249,7 @@ class Lexer():
         self.function = function
         self.text = text
         self.pos = 0
-        self.current_char = text[0]
+        self.current_char = text[0] if text else None
         
 
 
@@ -92,7 +280,6 @@ class Lexer():
                 self.advance()
             elif self.current_char == "-":
                 tokens.append(self.make_minus_or_arrow())
-                self.advance()
             elif self.current_char == "/":
                 tokens.append(Token(T_DIV,pos_start=self.pos))
                 self.advance()
@@ -170,6 +357,8 @@ class Lexer():
             string += self.current_char
             self.advance()
         self.advance()
+        if len(string) <= INTERN_MAX_LENGTH:
+            string = sys.intern(string)
         return Token(T_STRING,string,pos_start=pos_start,pos_end=self.pos)
 
     def make_minus_or_arrow(self):
@@ -177,7 +366,7 @@ class Lexer():
         pos_start = self.pos
         self.advance()
         if self.current_char == ">":
-            # self.advance()
+            self.advance()
             token_type = T_ARROW
         
         return Token(token_type,pos_start=pos_start, pos_end=self.pos)
@@ -191,7 +380,7 @@ class Lexer():
             self.advance()
 
         token_type = T_KEYWORD if identifier_string in KEYWORDS else T_IDENTIFIER
-        return Token(token_type,identifier_string,pos_start=pos_start,pos_end=self.pos)
+        return Token(token_type,sys.intern(identifier_string),pos_start=pos_start,pos_end=self.pos)
         
 
     def make_not_equals(self):
@@ -200,7 +389,7 @@ class Lexer():
 
         if self.current_char == "=":
             self.advance()
-            return Token(T_NOT_EQUAL,pos_start=pos_start,pos_end=self.pos)
+            return Token(T_NOT_EQUAL,pos_start=pos_start,pos_end=self.pos), None
         self.advance()
         return None, Exception("Expected Character '=' after '!' at {}".format(pos_start+1))
     
@@ -220,7 +409,7 @@ class Lexer():
         self.advance()
         if self.current_char == "=":
             self.advance()
-            token_type == T_LESSEREQUAL
+            token_type = T_LESSEREQUAL
         return Token(token_type,pos_start=pos_start,pos_end=self.pos)
         
 
@@ -230,12 +419,402 @@ class Lexer():
         self.advance()
         if self.current_char == "=":
             self.advance()
-            token_type == T_GREATEREQUAL
+            token_type = T_GREATEREQUAL
         return Token(token_type,pos_start=pos_start,pos_end=self.pos)
 
 
 
+#### REGEX LEXER ####
+
+TOKEN_SOURCE = r'''
+    [ \t\r\n]*
+    (?:(?P<STRING>"[^"]*"?)
+    |(?P<OPERATOR>->|==|!=?|<=|>=|[-=<>;:+/*()\[\]{}.,])
+    |(?P<NUMBER>[0-9]+(?:\.[0-9]*)?)
+    |(?P<NAME>[A-Za-z][A-Za-z0-9_]*)
+    |(?P<ILLEGAL>[^ \t\r\n]))
+'''
+TOKEN_PATTERN = re.compile(TOKEN_SOURCE, re.VERBOSE)
+# the same tokens over bytes, for memory-mapped files
+BYTES_TOKEN_PATTERN = re.compile(TOKEN_SOURCE.encode("ascii"), re.VERBOSE)
+
+OPERATOR_TOKENS = {
+    "->": T_ARROW, "==": T_EQUAL, "!=": T_NOT_EQUAL, "<=": T_LESSEREQUAL, ">=": T_GREATEREQUAL,
+    "-": T_MINUS, "=": T_ASSIGN, "<": T_LESSER, ">": T_GREATER, ";": T_NEWLINE, ":": T_COLON,
+    "+": T_PLUS, "/": T_DIV, "*": T_MUL, "(": T_LPAREN, ")": T_RPAREN, "[": T_LSQUARE,
+    "]": T_RSQUARE, "{": T_LBRACKET, "}": T_RBRACKET, ".": T_DOT, ",": T_COMMA,
+}
+BYTES_OPERATOR_TOKENS = {symbol.encode("ascii"): token_type for symbol,token_type in OPERATOR_TOKENS.items()}
+KEYWORD_SET = frozenset(KEYWORDS)
+OPERATOR_SYMBOLS = {token_type: symbol for symbol,token_type in OPERATOR_TOKENS.items()}
+
+
+class RegexLexer():
+    def __init__(self,function,text):
+        self.function = function
+        self.text = text
+
+    def make_tokens(self):
+        if type(self.text) != str:
+            return self.make_tokens_from_bytes()
+        text = self.text
+        tokens = TokenBuffer(len(text))
+        add_type = tokens.types.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        add_value_id = tokens.value_ids.append
+        values = tokens.values
+        add_value = values.append
+        operators = OPERATOR_TOKENS
+        keywords = KEYWORD_SET
+        end_of_text = len(text)
+        # value ids of the short strings and names seen so far, a repeated one points at the same value
+        interned = {}
+        intern = sys.intern
+
+        for match in TOKEN_PATTERN.finditer(text):
+            kind = match.lastgroup
+            pos_start, pos_end = match.span(kind)
+
+            if kind == "STRING":
+                add_type(T_STRING)
+                if pos_end - pos_start > 1 and text[pos_end-1] == '"':
+                    value = text[pos_start+1:pos_end-1]
+                else:
+                    end_of_text += 1
+                    value = text[pos_start+1:pos_end]
+                    pos_end = end_of_text
+                add_start(pos_start)
+                add_end(pos_end)
+                if len(value) <= INTERN_MAX_LENGTH:
+                    value_id = interned.get(value)
+                    if value_id is None:
+                        value_id = interned[value] = len(values)
+                        add_value(intern(value))
+                    add_value_id(value_id)
+                else:
+                    add_value_id(len(values))
+                    add_value(value)
+                continue
+            elif kind == "OPERATOR":
+                value = text[pos_start:pos_end]
+                if value == "!":
+                    return [], Exception("Expected Character '=' after '!' at {}".format(pos_start+1))
+                add_type(operators[value])
+                add_start(pos_start)
+                add_end(pos_end)
+                add_value_id(-1)
+                continue
+            elif kind == "NUMBER":
+                value = text[pos_start:pos_end]
+                if "." in value:
+                    add_type(T_FLOAT)
+                    add_value(float(value))
+                else:
+                    add_type(T_INTEGER)
+                    add_value(int(value))
+            elif kind == "NAME":
+                value = text[pos_start:pos_end]
+                add_type(T_KEYWORD if value in keywords else T_IDENTIFIER)
+                add_start(pos_start)
+                add_end(pos_end)
+                value_id = interned.get(value)
+                if value_id is None:
+                    value_id = interned[value] = len(values)
+                    add_value(intern(value))
+                add_value_id(value_id)
+                continue
+            else:
+                return [], Exception("IllegalCharError: at {} char: {}".format(pos_start,text[pos_start]))
+            add_start(pos_start)
+            add_end(pos_end)
+            add_value_id(len(values)-1)
+
+        tokens.add(T_ENDOFLINE,pos_start=end_of_text,pos_end=end_of_text+1)
+        return tokens,None
+
+    def make_tokens_from_bytes(self):
+        # positions are byte offsets and string payloads stay undecoded until a token is read
+        source = self.text
+        tokens = TokenBuffer(len(source),source)
+        add_type = tokens.types.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        add_value_id = tokens.value_ids.append
+        values = tokens.values
+        add_value = values.append
+        operators = BYTES_OPERATOR_TOKENS
+        keywords = KEYWORD_SET
+        end_of_text = len(source)
+
+        for match in BYTES_TOKEN_PATTERN.finditer(source):
+            kind = match.lastgroup
+            pos_start, pos_end = match.span(kind)
+
+            if kind == "STRING":
+                add_type(T_STRING)
+                add_start(pos_start)
+                if pos_end - pos_start > 1 and source[pos_end-1:pos_end] == b'"':
+                    add_end(pos_end)
+                    add_value_id(LAZY_STRING)
+                    continue
+                end_of_text += 1
+                add_value(source[pos_start+1:pos_end].decode("utf-8"))
+                add_end(end_of_text)
+                add_value_id(len(values)-1)
+                continue
+            elif kind == "OPERATOR":
+                value = source[pos_start:pos_end]
+                if value == b"!":
+                    return [], Exception("Expected Character '=' after '!' at {}".format(pos_start+1))
+                add_type(operators[value])
+                add_start(pos_start)
+                add_end(pos_end)
+                add_value_id(-1)
+                continue
+            elif kind == "NUMBER":
+                value = source[pos_start:pos_end]
+                if b"." in value:
+                    add_type(T_FLOAT)
+                    add_value(float(value))
+                else:
+                    add_type(T_INTEGER)
+                    add_value(int(value))
+            elif kind == "NAME":
+                value = sys.intern(source[pos_start:pos_end].decode("ascii"))
+                add_type(T_KEYWORD if value in keywords else T_IDENTIFIER)
+                add_value(value)
+            else:
+                character = source[pos_start:pos_start+4].decode("utf-8","replace")[:1]
+                return [], Exception("IllegalCharError: at {} char: {}".format(pos_start,character))
+            add_start(pos_start)
+            add_end(pos_end)
+            add_value_id(len(values)-1)
+
+        tokens.add(T_ENDOFLINE,pos_start=end_of_text,pos_end=end_of_text+1)
+        return tokens,None
+
+
+LEXERS = {
+    "legacy": Lexer,
+    "regex": RegexLexer,
+}
+DEFAULT_LEXER = "regex"
+
+
+def make_tokens(text,lexer=DEFAULT_LEXER):
+    if lexer not in LEXERS:
+        raise Exception("Unknown lexer '{}', expected one of {}".format(lexer,", ".join(LEXERS)))
+    return LEXERS[lexer]("",text).make_tokens()
+
+
+def diff_lexers(text,first="legacy",second="regex"):
+    first_tokens,first_error = make_tokens(text,first)
+    second_tokens,second_error = make_tokens(text,second)
+    differences = []
+    if str(first_error) != str(second_error):
+        differences.append((None,first_error,second_error))
+    for index in range(max(len(first_tokens),len(second_tokens))):
+        left = first_tokens[index] if index < len(first_tokens) else None
+        right = second_tokens[index] if index < len(second_tokens) else None
+        left_key = left and (left.type,left.value,left.pos_start,left.pos_end)
+        right_key = right and (right.type,right.value,right.pos_start,right.pos_end)
+        if left_key != right_key:
+            differences.append((index,left,right))
+    return differences
+
+
+
+#### STREAMING ####
+
+STREAM_CHUNK_SIZE = 1 << 16
+STREAM_WINDOW = 16
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+
+class StreamLexer():
+    def __init__(self,file,chunk_size=STREAM_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        operators = OPERATOR_TOKENS
+        keywords = KEYWORD_SET
+        buffer = ""
+        offset = 0
+        at_end = False
+
+        while not at_end:
+            chunk = self.file.read(self.chunk_size)
+            at_end = not chunk
+            buffer += chunk
+            consumed = len(buffer)
+
+            for match in TOKEN_PATTERN.finditer(buffer):
+                kind = match.lastgroup
+                pos_start, pos_end = match.span(kind)
+                if pos_end == len(buffer) and not at_end:
+                    # the token may continue in the next chunk
+                    consumed = pos_start
+                    break
+
+                if kind == "STRING":
+                    if pos_end - pos_start > 1 and buffer[pos_end-1] == '"':
+                        yield Token(T_STRING,buffer[pos_start+1:pos_end-1],offset+pos_start,offset+pos_end)
+                    else:
+                        yield Token(T_STRING,buffer[pos_start+1:pos_end],offset+pos_start,offset+pos_end+1)
+                        offset += 1
+                elif kind == "OPERATOR":
+                    value = buffer[pos_start:pos_end]
+                    if value == "!":
+                        raise Exception("Expected Character '=' after '!' at {}".format(offset+pos_start+1))
+                    yield Token(operators[value],pos_start=offset+pos_start,pos_end=offset+pos_end)
+                elif kind == "NUMBER":
+                    value = buffer[pos_start:pos_end]
+                    if "." in value:
+                        yield Token(T_FLOAT,float(value),offset+pos_start,offset+pos_end)
+                    else:
+                        yield Token(T_INTEGER,int(value),offset+pos_start,offset+pos_end)
+                elif kind == "NAME":
+                    value = sys.intern(buffer[pos_start:pos_end])
+                    yield Token(T_KEYWORD if value in keywords else T_IDENTIFIER,value,offset+pos_start,offset+pos_end)
+                else:
+                    raise Exception("IllegalCharError: at {} char: {}".format(offset+pos_start,buffer[pos_start]))
+
+            buffer = buffer[consumed:]
+            offset += consumed
+
+        yield Token(T_ENDOFLINE,pos_start=offset)
+
+
+class TokenWindow:
+    def __init__(self,tokens,size=STREAM_WINDOW):
+        self.tokens = iter(tokens)
+        self.window = deque(maxlen=size)
+        self.offset = 0
+        self.types = TokenWindowTypes(self)
+
+    def __getitem__(self,index):
+        window = self.window
+        while index >= self.offset + len(window):
+            try:
+                token = next(self.tokens)
+            except StopIteration:
+                raise IndexError("token index out of range")
+            if len(window) == window.maxlen:
+                self.offset += 1
+            window.append(token)
+        if index < self.offset:
+            raise Exception("Token {} is no longer inside the streaming window".format(index))
+        return window[index - self.offset]
+
+
+class TokenWindowTypes:
+    def __init__(self,window):
+        self.window = window
+
+    def __getitem__(self,index):
+        return self.window[index].type
+
+
+def this_references(tokens):
+    names = set()
+    after_this = 0
+    for token in tokens:
+        if after_this == 1:
+            after_this = 2 if token.type == T_DOT else 0
+            if after_this == 0:
+                return None
+        elif after_this == 2:
+            if token.type == T_IDENTIFIER:
+                names.add(token.value)
+            after_this = 0
+        elif token.type == T_KEYWORD and token.value == "this":
+            after_this = 1
+    return names
+
+
+#### JSON PASSTHROUGH ####
+
+JSON_WHITESPACE = str.maketrans("",""," \t\n\r")
+JSON_WHITESPACE_PATTERN = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|[ \t\n\r]+')
+FIRST_BYTE_PATTERN = re.compile(rb"[^ \t\n\r]")
+
+
+def reject_constant(name):
+    raise ValueError("{} is not valid JSON".format(name))
+
+
+def compact_json(text):
+    if '\\"' in text:
+        return JSON_WHITESPACE_PATTERN.sub(r"\1",text)
+    # every other piece is outside of a string
+    pieces = text.split('"')
+    pieces[0::2] = [piece.translate(JSON_WHITESPACE) for piece in pieces[0::2]]
+    return '"'.join(pieces)
+
+
+COMPACT_CHUNK_SIZE = 1 << 20
+# nesting levels a plain JSON span may have and still be handed to the json module
+RAW_MAX_DEPTH = 200
+JSON_WHITESPACE_BYTES = b" \t\n\r"
+
+
+def write_compact_json(source,start,end,output):
+    # compacts source[start:end] a chunk at a time, so a huge span never exists as one string or one list of pieces
+    is_text = type(source) == str
+    quote = '"' if is_text else b'"'
+    if source.find('\\"' if is_text else b'\\"',start,end) != -1:
+        text = source[start:end]
+        output.write(compact_json(text if is_text else text.decode("utf-8")))
+        return
+
+    decoder = None if is_text else codecs.getincrementaldecoder("utf-8")()
+    inside_string = False
+    for chunk_start in range(start,end,COMPACT_CHUNK_SIZE):
+        pieces = source[chunk_start:min(end,chunk_start+COMPACT_CHUNK_SIZE)].split(quote)
+        outside = 1 if inside_string else 0
+        if is_text:
+            pieces[outside::2] = [piece.translate(JSON_WHITESPACE) for piece in pieces[outside::2]]
+        else:
+            pieces[outside::2] = [piece.translate(None,JSON_WHITESPACE_BYTES) for piece in pieces[outside::2]]
+        if len(pieces) % 2 == 0:
+            inside_string = not inside_string
+        compacted = quote.join(pieces)
+        output.write(compacted if is_text else decoder.decode(compacted))
+    if decoder is not None:
+        output.write(decoder.decode(b"",True))
+
+
+def discard_pairs(pairs):
+    return None
+
+
+def raw_document(text):
+    if type(text) == str:
+        start = text.lstrip()[:1]
+        if (start != "{" and start != "[") or "->" in text:
+            return None
+    else:
+        match = FIRST_BYTE_PATTERN.search(text)
+        if match is None or match.group() not in (b"{",b"[") or text.find(b"->") != -1:
+            return None
+    raw_node = RawNode(text)
+    return raw_node if raw_node.is_valid() else None
+
+
+def decode_string(string):
+    if "\\" not in string:
+        return string
+    try:
+        return json.loads('"' + string + '"')
+    except ValueError:
+        return string
+
+
 class NameValuePairNode:
+    __slots__ = ("name", "value_token")
+
     def __init__(self,name,value_token):
         self.name = name
         self.value_token = value_token
@@ -245,6 +824,8 @@ class NameValuePairNode:
 
 
 class ValueNode:
+    __slots__ = ("value_token",)
+
     def __init__(self,value_token):
         self.value_token = value_token
 
@@ -252,6 +833,8 @@ class ValueNode:
         return self.value_token
 
 class BinaryNode:
+    __slots__ = ("value",)
+
     def __init__(self,value:bool):
         self.value = value
 
@@ -259,68 +842,175 @@ class BinaryNode:
         return f"BinaryNode({self.value})"
 
 class NoneNode:
+    __slots__ = ()
+
     def __repr__(self):
         return "NoneNode()"
 
 class ObjectNode:
-    def __init__(self,name_value_pair_nodes):
-        self.name_value_pair_nodes = name_value_pair_nodes
+    # keys is a tuple shared by every object with the same keys in the same order (its shape),
+    # values holds the member nodes in the same order; keys are source text, escapes included
+    __slots__ = ("keys", "values")
+
+    def __init__(self,keys,values):
+        self.keys = keys
+        self.values = values
+
+    @property
+    def name_value_pair_nodes(self):
+        return [NameValuePairNode(StringNode(key),value) for key,value in zip(self.keys,self.values)]
 
     def __repr__(self):
-        arr = []
-        for nvp_node in self.name_value_pair_nodes:
-            arr.append(nvp_node)
-        return f"ObjectNode({arr})"
+        return f"ObjectNode({self.name_value_pair_nodes})"
+
 class ArrayNode:
+    __slots__ = ("object_nodes",)
+
     def __init__(self,object_nodes):
         self.object_nodes = object_nodes
     
     def __repr__(self):
         return f"ArrayNode({self.object_nodes})"
 
+class RawNode:
+    __slots__ = ("source", "start", "end")
+
+    def __init__(self,source,start=0,end=None):
+        # the span is sliced out of the source only when it is used, a bytes source is decoded then too
+        self.source = source
+        self.start = start
+        self.end = len(source) if end is None else end
+
+    @property
+    def text(self):
+        text = self.source[self.start:self.end]
+        return text if type(text) == str else text.decode("utf-8")
+
+    def is_valid(self):
+        try:
+            # objects are dropped as soon as they are parsed, only the syntax matters here
+            json.loads(self.source[self.start:self.end],parse_constant=reject_constant,object_pairs_hook=discard_pairs)
+        except (ValueError,RecursionError):
+            return False
+        return True
+
+    def value(self):
+        return json.loads(self.source[self.start:self.end])
+
+    def compact(self):
+        return compact_json(self.text)
+
+    def write_compact(self,output):
+        write_compact_json(self.source,self.start,self.end,output)
+
+    def __getstate__(self):
+        # a pickled node carries its own text, not the whole source or a memory map
+        text = self.text
+        return {"source": text, "start": 0, "end": len(text)}
+
+    def __setstate__(self,state):
+        for name,value in state.items():
+            setattr(self,name,value)
+
+    def __repr__(self):
+        return "RawNode({} chars)".format(self.end - self.start)
+
 class StringNode:
+    __slots__ = ("string",)
+
     def __init__(self,string):
         self.string = string
 
+    def value(self):
+        # string holds the source text between the quotes, escapes included
+        return decode_string(self.string)
+
     def __repr__(self):
         return f'StringNode("{self.string}")'
 
 class IntegerNode:
+    __slots__ = ("integer",)
+
     def __init__(self,integer):
         self.integer = integer
 
     def __repr__(self):
         return f'IntegerNode({self.integer})'
 
+class FloatNode:
+    __slots__ = ("number",)
+
+    def __init__(self,number):
+        self.number = number
+
+    def __repr__(self):
+        return f'FloatNode({self.number})'
+
 class ListNode:
+  __slots__ = ("element_nodes",)
+
   def __init__(self, element_nodes):
     self.element_nodes = element_nodes
 
 class VarAccessNode:
-    def __init__(self, var_name_tok):
+    __slots__ = ("var_name_tok", "slot")
+
+    def __init__(self, var_name_tok, slot=None):
         self.var_name_tok = var_name_tok
+        self.slot = slot
 
     def __repr__(self):
         return 'VarAccessNode("{}")'.format(self.var_name_tok)
 
 class VarAssignNode:
-    def __init__(self, var_name_tok, value_node):
+    __slots__ = ("var_name_tok", "value_node", "slot")
+
+    def __init__(self, var_name_tok, value_node, slot=None):
         self.var_name_tok = var_name_tok
         self.value_node = value_node
+        self.slot = slot
 
     def __repr__(self):
         return 'VarAssignNode("{}",{})'.format(self.var_name_tok,self.value_node)
 
 class BinOpNode:
+  __slots__ = ("left_node", "op_tok", "right_node")
+
   def __init__(self, left_node, op_tok, right_node):
     self.left_node = left_node
     self.op_tok = op_tok
     self.right_node = right_node
 
   def __repr__(self):
-    return f'BinOpNode({self.left_node}, {self.op_tok}, {self.right_node})'
+    steps = []
+    node = self
+    while type(node) == BinOpNode:
+        steps.append(node)
+        node = node.left_node
+    text = repr(node)
+    for step in reversed(steps):
+        text = f'BinOpNode({text}, {step.op_tok}, {step.right_node})'
+    return text
+
+  def __reduce__(self):
+    # pickled as a flat list of steps, a long formula would otherwise exceed the recursion limit
+    steps = []
+    node = self
+    while type(node) == BinOpNode:
+        steps.append((node.op_tok,node.right_node))
+        node = node.left_node
+    steps.reverse()
+    return (binary_chain,(node,steps))
+
+def binary_chain(first,steps):
+    node = first
+    for op_tok,right_node in steps:
+        node = BinOpNode(node,op_tok,right_node)
+    return node
 
 class UnaryOpNode:
+  __slots__ = ("op_tok", "node")
+
   def __init__(self, op_tok, node):
     self.op_tok = op_tok
     self.node = node
@@ -329,28 +1019,58 @@ class UnaryOpNode:
     return f'({self.op_tok}, {self.node})'
 
 class IfNode:
+  __slots__ = ("cases", "else_case")
+
   def __init__(self, cases, else_case):
     self.cases = cases
     self.else_case = else_case
 
+  def __repr__(self):
+    return f'IfNode({self.cases}, {self.else_case})'
+
 class ForNode:
-  def __init__(self, var_name_tok, start_value_node, end_value_node, step_value_node, body_node, should_return_null):
+  __slots__ = ("var_name_tok", "start_value_node", "end_value_node", "step_value_node", "body_node", "should_return_null", "slot")
+
+  def __init__(self, var_name_tok, start_value_node, end_value_node, step_value_node, body_node, should_return_null, slot=None):
     self.var_name_tok = var_name_tok
     self.start_value_node = start_value_node
     self.end_value_node = end_value_node
     self.step_value_node = step_value_node
     self.body_node = body_node
     self.should_return_null = should_return_null
+    self.slot = slot
+
+  def __repr__(self):
+    return f'ForNode({self.var_name_tok}, {self.start_value_node}, {self.end_value_node}, {self.step_value_node}, {self.body_node})'
 
 class WhileNode:
+    __slots__ = ("condition_node", "body_node", "should_return_null")
+
     def __init__(self,condition_node, body_node, should_return_null):
         self.condition_node = condition_node
         self.body_node = body_node
         self.should_return_null = should_return_null
 
+    def __repr__(self):
+        return 'WhileNode({}, {})'.format(self.condition_node,self.body_node)
+
 class FuncDefNode:
-    def __init__(self,body_node):
+    __slots__ = ("body_node", "slot_count", "compiled")
+
+    def __init__(self,body_node,slot_count=0):
         self.body_node = body_node
+        self.slot_count = slot_count
+        # the compiled closure takes the interpreter as an argument, so every interpreter running this tree shares it
+        self.compiled = None
+
+    def __getstate__(self):
+        # closures can't be pickled, the unpickled node compiles again on first use
+        return {"body_node": self.body_node, "slot_count": self.slot_count}
+
+    def __setstate__(self,state):
+        for name,value in state.items():
+            setattr(self,name,value)
+        self.compiled = None
     
     def __repr__(self):
         str_ = "FunctionDefNode("
@@ -360,12 +1080,16 @@ class FuncDefNode:
         return str_
 
 class ThisNode:
+    __slots__ = ("after_identifier",)
+
     def __init__(self,after_identifier):
         self.after_identifier = after_identifier
     def __repr__(self):
         return "ThisNode({})".format(self.after_identifier)
 
 class ChildAccessNode:
+    __slots__ = ("access_node",)
+
     def __init__(self,access_node):
         self.access_node = access_node
 
@@ -373,22 +1097,59 @@ class ChildAccessNode:
         return "ChildAccessNode({})".format(self.access_node)
 
 class ReturnNode:
+    __slots__ = ("node_to_return",)
+
     def __init__(self,node_to_return):
         self.node_to_return = node_to_return
 
     def __repr__(self):
         return 'ReturnNode({})'.format(self.node_to_return)
 class ContinueNode:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
+    def __repr__(self):
+        return 'ContinueNode()'
+
 class BreakNode:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
+    def __repr__(self):
+        return 'BreakNode()'
+
+# statements that end with a "{...}" block
+BLOCK_STATEMENTS = (IfNode,ForNode,WhileNode)
+
+# binding powers of the infix operators, higher binds tighter
+BINDING_POWERS = {
+    T_EQUAL: 1, T_NOT_EQUAL: 1,
+    T_LESSER: 2, T_GREATER: 2, T_LESSEREQUAL: 2, T_GREATEREQUAL: 2,
+    T_PLUS: 3, T_MINUS: 3,
+    T_MUL: 4, T_DIV: 4,
+}
+UNARY_POWER = 5
+
+
 class Parser:
-    def __init__(self,tokens):
+    def __init__(self,tokens,source=None):
         self.tokens = tokens
+        self.slots = {}
+        # function-free subtrees are kept as source text when the token positions are known
+        self.source = source if type(tokens) == TokenBuffer else None
+        self.raw_spans = None
+        # key tuples of the objects parsed so far, so objects with the same keys share one
+        self.shapes = {}
+        self.loop_depth = 0
+        # loops used as values, a return can't leave the function from inside one
+        self.value_loop_depth = 0
+        self.types = getattr(tokens,"types",None)
+        if self.types is None:
+            self.types = [token.type for token in tokens]
         self.token_index = -1
         self.advance()
     
@@ -411,70 +1172,235 @@ class Parser:
 
             self.advance()
 
-    def create_array_node(self):
-        left_square_counter = 0
-        array_objects = []
-        self.advance()
+    def parse_stream(self):
+        while self.current_token.type != T_ENDOFLINE:
+            if self.current_token.type == T_LBRACKET:
+                return ObjectNode, self.iter_object_members()
+            elif self.current_token.type == T_LSQUARE:
+                return ArrayNode, self.iter_array_elements()
 
-        while True:
-            if self.current_token.type == T_LSQUARE:
-                left_square_counter +=1
-            elif self.current_token.type == T_RSQUARE:
-                if left_square_counter > 0:
-                    left_square_counter -= 1
-                else:
-                    break
-            
-            elif self.current_token.type == T_LBRACKET:
-                
-                array_objects.append(self.create_object_node())
-            elif self.current_token.type == T_COMMA:
-                pass
-            else:
-                array_objects.append(self.expr())
-                self.advance()
-            
             self.advance()
-        return ArrayNode(array_objects)
+        return None, iter(())
+
+    def create_array_node(self):
+        raw_node = self.raw_subtree()
+        if raw_node is not None:
+            return raw_node
+        return ArrayNode(tuple(self.iter_array_elements()))
+
+    def find_raw_spans(self):
+        types = self.tokens.types
+        spans = {}
+        stack = []
+        for index,token_type in enumerate(types):
+            if token_type == T_LBRACKET or token_type == T_LSQUARE:
+                stack.append([index,False,1])
+            elif token_type == T_RBRACKET or token_type == T_RSQUARE:
+                if stack:
+                    open_index,has_function,depth = stack.pop()
+                    if stack and stack[-1][2] <= depth:
+                        stack[-1][2] = depth + 1
+                    # the json module recurses, deeper spans are parsed into nodes like function-bearing ones
+                    if not has_function and depth <= RAW_MAX_DEPTH:
+                        spans[open_index] = index
+            elif token_type == T_ARROW:
+                for entry in reversed(stack):
+                    if entry[1]:
+                        break
+                    entry[1] = True
+        return spans
+
+    def raw_subtree(self):
+        if self.source is None:
+            return None
+        if self.raw_spans is None:
+            self.raw_spans = self.find_raw_spans()
+        close_index = self.raw_spans.get(self.token_index)
+        if close_index is None:
+            return None
+
+        raw_node = RawNode(self.source,self.tokens.starts[self.token_index],self.tokens.ends[close_index])
+        if not raw_node.is_valid():
+            return None
+        self.token_index = close_index
+        self.current_token = self.tokens[close_index]
+        return raw_node
 
     def create_object_node(self):
-        left_bracket_counter = 0
+        raw_node = self.raw_subtree()
+        if raw_node is not None:
+            return raw_node
+        members = list(self.iter_object_members())
+        return ObjectNode(self.shape([member.name.string for member in members]),tuple(member.value_token for member in members))
+
+    def shape(self,keys):
+        keys = tuple(keys)
+        return self.shapes.setdefault(keys,keys)
+
+    def iter_array_elements(self):
+        return self.iter_container_items(T_RSQUARE)
+
+    def iter_object_members(self):
+        return self.iter_container_items(T_RBRACKET)
+
+    def iter_container_items(self,closing_type):
+        # nested containers are parsed with an explicit stack, so depth is limited by memory and not by recursion;
+        # a frame is [closing token type, member name in the parent, keys, values, unmatched "{" count].
+        # Tokens are skipped by type alone, one is only built for the parts that read it
+        tokens = self.tokens
+        types = self.types
+        index = self.token_index + 1
+        stack = [[closing_type,None,[],[],0]]
+        frame = stack[-1]
 
-        name_value_pair_nodes = []
-        self.advance()
         while True:
-            if self.current_token.type == T_LBRACKET:
-                left_bracket_counter += 1
-            elif self.current_token.type == T_RBRACKET:
-                if left_bracket_counter > 0:
-                    left_bracket_counter -= 1
+            token_type = types[index]
+            item = None
+            name = None
+
+            if token_type == T_COMMA or token_type == T_STRING and frame[0] == T_RBRACKET:
+                index += 1
+                continue
+            if token_type == frame[0] and not frame[4]:
+                if len(stack) == 1:
+                    self.token_index = index
+                    self.current_token = tokens[index]
+                    return
+                stack.pop()
+                if frame[0] == T_RBRACKET:
+                    item = ObjectNode(self.shape(frame[2]),tuple(frame[3]))
                 else:
-                    break
-            
-            elif self.current_token.type == T_COLON:
-                name_value_pair_nodes.append(self.expr())
-
+                    item = ArrayNode(tuple(frame[3]))
+                name = frame[1]
+                frame = stack[-1]
+            elif token_type == T_ENDOFLINE:
+                raise Exception("Expected '{}' before the end of the input".format("}" if frame[0] == T_RBRACKET else "]"))
+            elif frame[0] == T_RBRACKET:
+                if token_type == T_COLON:
+                    name = tokens[index-1].value
+                    self.advance(index + 1 - self.token_index)
+                    if self.current_token.type in (T_LBRACKET,T_LSQUARE):
+                        item = self.open_container(stack,name)
+                        frame = stack[-1]
+                    else:
+                        item = self.expr()
+                    index = self.token_index
+                elif token_type == T_LBRACKET:
+                    frame[4] += 1
+                elif token_type == T_RBRACKET:
+                    frame[4] -= 1
+            else:
+                self.advance(index - self.token_index)
+                if token_type in (T_LBRACKET,T_LSQUARE):
+                    item = self.open_container(stack,None)
+                    frame = stack[-1]
+                else:
+                    item = self.expr()
+                index = self.token_index
+
+            if item is not None:
+                if len(stack) > 1:
+                    if frame[0] == T_RBRACKET:
+                        frame[2].append(name)
+                    frame[3].append(item)
+                elif name is not None:
+                    yield NameValuePairNode(StringNode(name),item)
+                else:
+                    yield item
+            index += 1
 
-            self.advance()
-        
-        return ObjectNode(name_value_pair_nodes)
+    def open_container(self,stack,name):
+        raw_node = self.raw_subtree()
+        if raw_node is not None:
+            return raw_node
+        stack.append([T_RBRACKET if self.current_token.type == T_LBRACKET else T_RSQUARE,name,[],[],0])
+        return None
 
-        
     def func(self):
         self.advance()
-        function_body = []
         if self.current_token.type != T_LBRACKET:
             raise Exception('Unexpected Character: Expected "{" at {}'.format(self.token_index))
         else:
-            self.advance()
-            while self.current_token.type != T_RBRACKET:
-                function_body.append(self.atom())
+            # a function inside an object literal in a function body has its own slots and loops
+            outer = (self.slots,self.loop_depth,self.value_loop_depth)
+            self.slots = {}
+            self.loop_depth = 0
+            self.value_loop_depth = 0
+            try:
+                function_body = self.statements()
+                return FuncDefNode(function_body,len(self.slots))
+            finally:
+                self.slots,self.loop_depth,self.value_loop_depth = outer
+
+    def statements(self):
+        # the statements of a "{...}" block, the current token is left on its "}"
+        self.advance()
+        statements = []
+        while self.current_token.type != T_RBRACKET:
+            if self.current_token.type == T_NEWLINE:
                 self.advance()
-            return FuncDefNode(function_body)
+                continue
+            statement = self.atom()
+            statements.append(statement)
+            if type(statement) in BLOCK_STATEMENTS and self.tokens[self.token_index-1].type == T_RBRACKET:
+                # a block ends with its "}", the ";" after it is optional
+                continue
+            if self.current_token.type not in (T_NEWLINE,T_RBRACKET):
+                raise Exception("Expected ';' at {}".format(self.current_token.pos_start))
+        return statements
+
+    def block(self):
+        if self.current_token.type != T_LBRACKET:
+            raise Exception("Expected '{{' at {}".format(self.current_token.pos_start))
+        statements = self.statements()
+        self.advance()
+        return statements
+
+    def loop_body(self,should_return_null):
+        self.loop_depth += 1
+        if not should_return_null:
+            self.value_loop_depth += 1
+        try:
+            return self.block()
+        finally:
+            self.loop_depth -= 1
+            if not should_return_null:
+                self.value_loop_depth -= 1
+
+    def for_loop(self,should_return_null):
+        # for NAME in VALUE [, END] [step STEP] { ... }
+        self.advance()
+        if self.current_token.type != T_IDENTIFIER:
+            raise Exception("Expected an identifier after for at {}".format(self.current_token.pos_start))
+        name = self.current_token.value
+        self.advance()
+        if self.current_token.type != T_KEYWORD or self.current_token.value != "in":
+            raise Exception("Expected 'in' at {}".format(self.current_token.pos_start))
+        self.advance()
+        start_value_node = self.fexpr()
+        end_value_node = None
+        step_value_node = None
+        if self.current_token.type == T_COMMA:
+            self.advance()
+            end_value_node = self.fexpr()
+        if self.current_token.type == T_KEYWORD and self.current_token.value == "step":
+            self.advance()
+            step_value_node = self.fexpr()
+        slot = self.variable_slot(name)
+        return ForNode(name,start_value_node,end_value_node,step_value_node,self.loop_body(should_return_null),should_return_null,slot)
+
+    def while_loop(self,should_return_null):
+        self.advance()
+        condition_node = self.fexpr()
+        return WhileNode(condition_node,self.loop_body(should_return_null),should_return_null)
+
+    def variable_slot(self,name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
                 
 
     def atom(self):
-        print(self.current_token)
         if self.current_token.type == T_KEYWORD and self.current_token.value == "var":
             self.advance()
 
@@ -490,102 +1416,56 @@ class Parser:
             self.advance()
 
             value_node = self.fexpr()
-            print("value node", value_node)
-            return VarAssignNode(identifier,value_node)
+            return VarAssignNode(identifier,value_node,self.variable_slot(identifier))
 
         if self.current_token.type == T_KEYWORD and self.current_token.value == "if":
             self.advance()
             if_cases, else_case = self.create_if_inside()
             return IfNode(if_cases,else_case)
-            
-        if self.current_token.type == T_KEYWORD:
-            if self.current_token.value == "return":
-                self.advance()
-                returned_node = self.atom()
-                node = ReturnNode(returned_node)
-                if self.current_token.type == T_KEYWORD and self.current_token.value == "this":
-                    return self.atom()
-                if self.current_token.type != T_NEWLINE:
-                    print("current token",self.current_token)
-                    raise Exception("Expected ';' after return")
-
-                return node
-            if self.current_token.value == "this":
-                self.advance()
-                if self.current_token.type != T_DOT:
-                    if self.current_token.type == T_NEWLINE:
-                        return ThisNode([])
-                    raise Exception("Expected '.' at {}".format(self.current_token.pos_start))
-                self.advance()
-                
 
-                if self.current_token.type != T_IDENTIFIER:
-                    raise Exception("Expected identifier at {}".format(self.current_token.pos_start))
-                self.reverse()
+        # a loop written as a statement is run for its effects, its array is dropped
+        if self.current_token.type == T_KEYWORD and self.current_token.value == "for":
+            return self.for_loop(True)
 
-                this_node = ThisNode(self.this_children())
-                if self.current_token.type in [T_MINUS,T_PLUS,T_MUL,T_DIV]:
-                    op = self.current_token
-                    self.advance()
-                    this_node = self.add_bin_op(this_node,op,self.current_token)
-                    
+        if self.current_token.type == T_KEYWORD and self.current_token.value == "while":
+            return self.while_loop(True)
 
-                return this_node
+        if self.current_token.type == T_KEYWORD and self.current_token.value in ("break","continue"):
+            if not self.loop_depth:
+                raise Exception("{} outside of a loop at {}".format(self.current_token.value,self.current_token.pos_start))
+            node = BreakNode() if self.current_token.value == "break" else ContinueNode()
+            self.advance()
+            return node
             
-            if self.current_token.value == "true":
-                self.advance()
-                return BinaryNode(True)
-            if self.current_token.value == "false":
-                self.advance()
-                return BinaryNode(False)
-            if self.current_token.value == "null":
-                self.advance()
-                return NoneNode()
+        if self.current_token.type == T_KEYWORD and self.current_token.value == "return":
+            if self.value_loop_depth:
+                raise Exception("return inside a loop used as a value at {}".format(self.current_token.pos_start))
+            self.advance()
+            if self.current_token.type in (T_NEWLINE,T_RBRACKET):
+                return ReturnNode(NoneNode())
+            return ReturnNode(self.fexpr())
 
-        if self.current_token.type == T_IDENTIFIER:
+        if self.current_token.type == T_IDENTIFIER and self.tokens[self.token_index+1].type == T_ASSIGN:
             identifier = self.current_token.value
-            
-            self.advance()
-            if self.current_token.type == T_ASSIGN:
+            self.advance(2)
+            value_node = self.fexpr()
+            return VarAssignNode(identifier,value_node,self.variable_slot(identifier))
+
+        return self.fexpr()
+
+    def create_if_inside(self):
+        # if COND { ... } elif COND { ... } else { ... }
+        cases = [[self.fexpr(),self.block()]]
+        else_case = None
+        while self.current_token.type == T_KEYWORD and self.current_token.value in ("elif","else"):
+            if self.current_token.value == "elif":
                 self.advance()
-                value_node = self.atom()
-                return VarAssignNode(identifier,value_node)
-            elif self.current_token.type in [T_MUL,T_MINUS,T_PLUS,T_DIV]:
-                self.reverse()
-                print(self.current_token)
-                oparr = self.try_bin_op()
-                print(oparr)
-                if type(oparr) != list:
-                    return oparr
-                return oparr[0]
+                cases.append([self.fexpr(),self.block()])
             else:
-                self.reverse()
-                var_access_node = VarAccessNode(self.current_token.value)
                 self.advance()
-                return var_access_node
-        
-        if self.current_token.type == T_INTEGER:
-            intnode = IntegerNode(self.current_token.value)
-            self.advance()
-            return intnode
-        self.advance()
-        
-        return self.atom()
-
-    def create_if_inside(self):
-        ifcase = []
-        elif_cases = []
-        else_case = []
-        while self.current_token.type == T_NEWLINE:
-            while self.current_token.type == T_KEYWORD and self.current_token.value != "then":
-                if self.current_token.type == T_KEYWORD and self.current_token.value in ["true","false"]:
-                        pass
-                elif self.current_token.type in [T_INTEGER,T_STRING]:
-                    pass
-                pass
-
-
-
+                else_case = self.block()
+                break
+        return cases, else_case
 
     def this_children(self):
         children = []
@@ -616,91 +1496,71 @@ class Parser:
 
         return children
     
-    def add_bin_op(self,left,op,right):
-        return BinOpNode(left,op,self.try_bin_op())
-
-    def try_bin_op(self):
-        tokens_til_end = []
-        while True:
-            if self.current_token.type not in [T_INTEGER,T_STRING,T_PLUS,T_MINUS,T_MUL,T_DIV,T_IDENTIFIER]:
-                break
-            tokens_til_end.append(self.current_token)
+    def add_bin_op(self,left,op,power):
+        self.advance()
+        return BinOpNode(left,op,self.fexpr(power))
+
+    def fexpr(self,min_power=0):
+        # precedence climbing: operators of the same power loop here instead of recursing,
+        # so a long formula builds a left-leaning tree in linear time
+        left = self.operand()
+        power = BINDING_POWERS.get(self.current_token.type)
+        while power is not None and power > min_power:
+            left = self.add_bin_op(left,self.current_token,power)
+            power = BINDING_POWERS.get(self.current_token.type)
+        return left
+
+    def operand(self):
+        token = self.current_token
+
+        if token.type == T_INTEGER:
             self.advance()
-        op_counter = 0
-        
-        for index,token in enumerate(tokens_til_end):
-            if token.type in [T_MUL,T_DIV]:
-                binop = BinOpNode(self.bin(tokens_til_end[index-1]),token,self.bin(tokens_til_end[index+1]))
-                tokens_til_end.pop(index-1)
-                tokens_til_end.pop(index-1)
-                tokens_til_end.pop(index-1)
-                op_counter += 1
-                tokens_til_end.insert(index-1,binop)
-        
-        if op_counter == 0:
-            self.reverse()
-            binned = self.bin(self.current_token)
+            return IntegerNode(token.value)
+        elif token.type == T_FLOAT:
             self.advance()
-            return binned
-
-        while len(tokens_til_end) != 1:
-            for index,token in enumerate(tokens_til_end):
-                if type(token) != BinOpNode:
-                    if token.type in [T_PLUS,T_MINUS]:
-                        binop = BinOpNode(self.bin(tokens_til_end[index-1]),token,self.bin(tokens_til_end[index+1]))
-                        tokens_til_end.pop(index-1)
-                        tokens_til_end.pop(index-1)
-                        tokens_til_end.pop(index-1)
-                        tokens_til_end.insert(index-1,binop)
-                        
-        return tokens_til_end
-
-
-    def bin(self,tok):
-        if type(tok) != Token:
-            return tok
-        if tok.type == T_INTEGER:
-            return IntegerNode(tok.value)
-        elif tok.type == T_STRING:
-            return StringNode(tok.value)
-        elif tok.type == T_IDENTIFIER:
-            return VarAccessNode(tok.value)
-            
-
-    def fexpr(self):
-        
-        if self.current_token.type == T_COMMA:
-            pass            
-        if self.current_token.type == T_MINUS:
-            self.try_unary()
-            return UnaryOpNode(self.current_token,self.fexpr())
-        elif self.current_token.type == T_STRING:
-            node = self.try_bin_op()
-            return node
-        elif self.current_token.type == T_INTEGER:
-            node = self.try_bin_op()
-            return node
-        elif self.current_token.type == T_KEYWORD and self.current_token.value == "this":
-            return self.atom()
-        elif self.current_token.type == T_KEYWORD and self.current_token.value == "true":
-            return BinaryNode(True)
-        elif self.current_token.type == T_KEYWORD and self.current_token.value == "false":
-            return BinaryNode(False)
-        elif self.current_token.type == T_KEYWORD and self.current_token.value == "null":
-            return NoneNode()
-        elif self.current_token.type == T_LBRACKET:
-            return self.create_object_node()
-        elif self.current_token.type == T_LSQUARE:
-            return self.create_array_node()
-        elif self.current_token.type == T_LPAREN:
+            return FloatNode(token.value)
+        elif token.type == T_STRING:
+            self.advance()
+            return StringNode(token.value)
+        elif token.type == T_IDENTIFIER:
+            self.advance()
+            return VarAccessNode(token.value,self.variable_slot(token.value))
+        elif token.type == T_MINUS:
+            self.advance()
+            return UnaryOpNode(token,self.fexpr(UNARY_POWER))
+        elif token.type == T_LPAREN:
             self.advance()
             node = self.fexpr()
+            if self.current_token.type != T_RPAREN:
+                raise Exception("Expected ')' at {}".format(self.current_token.pos_start))
             self.advance()
             return node
-        elif self.current_token.type == T_RPAREN:
-            return None
-        else:
-            raise Exception("Unknown Character")
+        elif token.type == T_LBRACKET:
+            node = self.create_object_node()
+            self.advance()
+            return node
+        elif token.type == T_LSQUARE:
+            node = self.create_array_node()
+            self.advance()
+            return node
+        elif token.type == T_KEYWORD:
+            if token.value == "this":
+                self.advance()
+                return ThisNode(self.this_children())
+            elif token.value == "true":
+                self.advance()
+                return BinaryNode(True)
+            elif token.value == "false":
+                self.advance()
+                return BinaryNode(False)
+            elif token.value == "null":
+                self.advance()
+                return NoneNode()
+            elif token.value == "for":
+                return self.for_loop(False)
+            elif token.value == "while":
+                return self.while_loop(False)
+        raise Exception("Unexpected {} at {}".format(TOKEN_NAMES[token.type],token.pos_start))
  
     def expr(self):
         self.current_token
@@ -718,6 +1578,8 @@ class Parser:
             return StringNode(self.current_token.value)
         elif self.current_token.type == T_INTEGER:
             return IntegerNode(self.current_token.value)
+        elif self.current_token.type == T_FLOAT:
+            return FloatNode(self.current_token.value)
         elif self.current_token.type == T_KEYWORD and self.current_token.value == "true":
             return BinaryNode(True)
         elif self.current_token.type == T_KEYWORD and self.current_token.value == "false":
@@ -733,192 +1595,2236 @@ class Parser:
 
 
 
-globalVariableTable = []
+class Scope:
+    __slots__ = ("values",)
 
-[
-    
-]
+    def __init__(self,slot_count):
+        self.values = [UNASSIGNED] * slot_count
 
-class Interpreter():
-    def __init__(self,node):
-        self.node = node
 
-    def execute(self):
-        return self.interp(self.node)
-    
-    def f_interp(self,node,this=None):
-        print("node",node)
-        return_str = ""
+#### EVALUATION PLAN ####
+
+FUNCTION_CHILD_ATTRIBUTES = ("body_node","value_node","left_node","right_node","node_to_return","node",
+    "start_value_node","end_value_node","step_value_node","condition_node","cases","else_case")
+
 
+def function_this_paths(func_node):
+    paths = []
+    stack = [func_node]
+    while stack:
+        node = stack.pop()
+        if type(node) == list:
+            stack.extend(node)
+        elif type(node) == ThisNode:
+            paths.append([child.access_node for child in node.after_identifier])
+        elif node is not None:
+            for attribute in FUNCTION_CHILD_ATTRIBUTES:
+                child = getattr(node,attribute,None)
+                if child is not None and type(child) not in (str,int,Token):
+                    stack.append(child)
+    return paths
+
+
+def functions_in(node):
+    functions = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
         if type(node) == FuncDefNode:
+            functions.append(node)
+        elif type(node) == ObjectNode:
+            stack.extend(node.values)
+        elif type(node) == ArrayNode:
+            stack.extend(node.object_nodes)
+    return functions
+
+
+# a label is a (parent label, key) link, so deep documents don't build a path string per level
+ROOT_LABEL = None
+
+
+def label_text(label):
+    keys = []
+    while label is not ROOT_LABEL:
+        label,key = label
+        keys.append("[{}]".format(key) if type(key) == int else "." + key)
+    return "this" + "".join(reversed(keys))
+
+
+class EvaluationPlan:
+    def __init__(self,root):
+        self.owners = {}
+        self.labels = {}
+        self.functions = []
+        self.dependencies = {}
+        self.indexes = {}
+        self.collect(root)
+        for func_node in self.functions:
+            self.dependencies[id(func_node)] = self.find_dependencies(func_node)
+        self.order = self.sort()
+
+    def collect(self,root):
+        stack = [(root,None,ROOT_LABEL)]
+        while stack:
+            node,owner,label = stack.pop()
+            if type(node) == FuncDefNode:
+                self.functions.append(node)
+                self.owners[id(node)] = owner
+                self.labels[id(node)] = label
+            elif type(node) == ObjectNode:
+                for index in range(len(node.values)-1,-1,-1):
+                    stack.append((node.values[index],node,(label,node.keys[index])))
+            elif type(node) == ArrayNode:
+                for index in range(len(node.object_nodes)-1,-1,-1):
+                    stack.append((node.object_nodes[index],None,(label,index)))
+
+    def member_index(self,object_node):
+        index = self.indexes.get(id(object_node))
+        if index is None:
+            index = self.indexes[id(object_node)] = dict(zip(object_node.keys,object_node.values))
+        return index
+
+    def find_dependencies(self,func_node):
+        owner = self.owners[id(func_node)]
+        dependencies = []
+        if owner is None:
+            return dependencies
+
+        for path in function_this_paths(func_node):
+            if not path:
+                dependencies.extend(function for function in functions_in(owner) if function is not func_node)
+                continue
+
+            current = owner
+            for key in path:
+                if type(current) == ObjectNode:
+                    current = self.member_index(current).get(key)
+                elif type(current) == ArrayNode and type(key) == int and key < len(current.object_nodes):
+                    current = current.object_nodes[key]
+                else:
+                    current = None
+                if current is None or type(current) == FuncDefNode:
+                    break
+            if current is not None:
+                dependencies.extend(functions_in(current))
+        return dependencies
+
+    def sort(self):
+        order = []
+        state = {}
+        for func_node in self.functions:
+            if id(func_node) in state:
+                continue
+            state[id(func_node)] = 1
+            stack = [(func_node,iter(self.dependencies[id(func_node)]))]
+            while stack:
+                node,dependencies = stack[-1]
+                for dependency in dependencies:
+                    dependency_state = state.get(id(dependency))
+                    if dependency_state == 1:
+                        cycle = [entry[0] for entry in stack]
+                        cycle = cycle[cycle.index(dependency):] + [dependency]
+                        raise Exception("Circular this reference: {}".format(" -> ".join(label_text(self.labels[id(function)]) for function in cycle)))
+                    if dependency_state is None:
+                        state[id(dependency)] = 1
+                        stack.append((dependency,iter(self.dependencies[id(dependency)])))
+                        break
+                else:
+                    stack.pop()
+                    state[id(node)] = 2
+                    order.append(node)
+        return order
 
-            for body_element in node.body_node:
 
-                return_str += str(self.f_interp(body_element,this))
-            
+#### PARALLEL EVALUATION ####
+
+FIELD_POOLS = ("thread","process")
+# set in every process of a process pool: (interpreter, functions, owners)
+field_worker = None
+
+
+def evaluation_waves(plan):
+    # a function runs in the wave after the last function it depends on, so the functions of one wave are independent
+    waves = []
+    wave_of = {}
+    for func_node in plan.order:
+        wave = 0
+        for dependency in plan.dependencies[id(func_node)]:
+            wave = max(wave,wave_of[id(dependency)] + 1)
+        wave_of[id(func_node)] = wave
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(func_node)
+    source_order = {id(func_node): index for index,func_node in enumerate(plan.functions)}
+    for wave in waves:
+        wave.sort(key=lambda func_node: source_order[id(func_node)])
+    return waves
+
+
+def start_field_worker(node,functions,owners,compiled,budget):
+    global field_worker
+    # events from several processes would interleave on one output
+    disable_tracing()
+    field_worker = (Interpreter(node,compiled,budget=budget),functions,owners)
+
+
+def evaluate_field_in_worker(index,dependency_results):
+    interpreter,functions,owners = field_worker
+    for dependency_index,value in dependency_results:
+        interpreter.function_results[id(functions[dependency_index])] = value
+    owner = owners[index]
+    return interpreter.evaluate_function(functions[index],interpreter.context_for(owner) if owner is not None else None)
+
+
+#### RUNTIME VALUES ####
+
+# runtime values are plain Python values: int, float, str, bool, None (null), list and dict
+UNASSIGNED = object()
+NUMBER_TYPES = (int,float)
+VALUE_TYPE_NAMES = {int: "int", float: "float", str: "str", bool: "bool", type(None): "null", list: "list", dict: "object"}
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False,separators=(",",":"),allow_nan=False)
+value_to_json = JSON_ENCODER.encode
+
+
+def value_to_text(value):
+    if type(value) == str:
+        return value
+    return value_to_json(value)
+
+
+def operand_error(verb,left,right):
+    return Exception("Can't {} {} and {}".format(verb,VALUE_TYPE_NAMES.get(type(left),"value"),VALUE_TYPE_NAMES.get(type(right),"value")))
+
+
+def add_values(left,right):
+    left_type = type(left)
+    right_type = type(right)
+    if left_type in NUMBER_TYPES and right_type in NUMBER_TYPES:
+        return left + right
+    if left_type == str or right_type == str:
+        return value_to_text(left) + value_to_text(right)
+    if left_type == list and right_type == list:
+        return left + right
+    raise operand_error("add",left,right)
+
+
+def subtract_values(left,right):
+    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+        return left - right
+    raise operand_error("subtract",left,right)
+
+
+def multiply_values(left,right):
+    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+        return left * right
+    raise operand_error("multiply",left,right)
+
+
+def divide_values(left,right):
+    if type(left) not in NUMBER_TYPES or type(right) not in NUMBER_TYPES:
+        raise operand_error("divide",left,right)
+    if right == 0:
+        raise Exception("Division by 0 not allowed")
+    # JSON has one number type, so an exact integer quotient stays an int
+    if type(left) == int and type(right) == int and left % right == 0:
+        return left // right
+    return left / right
+
+
+def negate_value(value):
+    if type(value) in NUMBER_TYPES:
+        return -value
+    raise Exception("Can't negate {}".format(VALUE_TYPE_NAMES.get(type(value),"value")))
+
+
+def values_equal(left,right):
+    # true and 1 are different JSON values even though Python compares them equal
+    if type(left) != type(right) and not (type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES):
+        return False
+    return left == right
+
+
+def values_not_equal(left,right):
+    return not values_equal(left,right)
+
+
+def comparable(left,right):
+    if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+        return True
+    return type(left) == str and type(right) == str
+
+
+def value_less(left,right):
+    if comparable(left,right):
+        return left < right
+    raise operand_error("compare",left,right)
+
+
+def value_greater(left,right):
+    if comparable(left,right):
+        return left > right
+    raise operand_error("compare",left,right)
+
+
+def value_less_equal(left,right):
+    if comparable(left,right):
+        return left <= right
+    raise operand_error("compare",left,right)
+
+
+def value_greater_equal(left,right):
+    if comparable(left,right):
+        return left >= right
+    raise operand_error("compare",left,right)
+
+
+BINARY_OPERATIONS = {
+    T_PLUS: add_values, T_MINUS: subtract_values, T_MUL: multiply_values, T_DIV: divide_values,
+    T_EQUAL: values_equal, T_NOT_EQUAL: values_not_equal,
+    T_LESSER: value_less, T_GREATER: value_greater, T_LESSEREQUAL: value_less_equal, T_GREATEREQUAL: value_greater_equal,
+}
+
+
+def function_result(results):
+    if len(results) == 1:
+        return results[0]
+    if not results:
+        return None
+    return "".join(value_to_text(result) for result in results)
+
+
+# returned by a block that ran into break, continue or return; a return leaves its value last in the results
+BREAK = "break"
+CONTINUE = "continue"
+RETURN = "return"
+
+
+def loop_values(value,end,step):
+    # for i in 5 counts 0 to 4, for i in 2, 10 step 2 counts from 2 up to 10;
+    # without an end or a step an array gives its elements and an object its keys
+    if end is None and step is None:
+        if type(value) == list:
+            return value
+        if type(value) == dict:
+            return list(value)
+    if end is None:
+        value,end = 0,value
+    if step is None:
+        step = 1
+    for bound in (value,end,step):
+        if type(bound) != int:
+            raise Exception("Can't loop over {}".format(VALUE_TYPE_NAMES.get(type(bound),"value")))
+    if step == 0:
+        raise Exception("The step of a for loop can't be 0")
+    return range(value,end,step)
+
+
+SIZED_TYPES = (str,list,dict)
+
+
+def value_size(value):
+    if type(value) in SIZED_TYPES:
+        return len(value)
+    return 1
+
+
+#### BUDGETS ####
+
+# steps between two looks at the clock
+DEADLINE_CHECK_INTERVAL = 1000
+
+
+class Budget:
+    # limits one document's evaluation: steps are loop iterations and function fields,
+    # output is counted in characters written, and in elements or characters for values built by loops
+    def __init__(self,max_steps=None,max_output=None,timeout=None):
+        self.max_steps = max_steps
+        self.max_output = max_output
+        self.timeout = timeout
+        self.start()
+
+    def start(self):
+        self.steps = 0
+        self.output = 0
+        self.deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        self.schedule_check()
+
+    def schedule_check(self):
+        # step() only compares two integers, the limits are looked at when steps reaches next_check
+        self.next_check = self.max_steps + 1 if self.max_steps is not None else sys.maxsize
+        if self.deadline is not None:
+            self.next_check = min(self.next_check,self.steps + DEADLINE_CHECK_INTERVAL)
+
+    def step(self):
+        self.steps += 1
+        if self.steps >= self.next_check:
+            self.check()
+
+    def check(self):
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise Exception("Evaluation stopped: more than {} steps".format(self.max_steps))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise Exception("Evaluation stopped: deadline of {}s passed after {} steps".format(self.timeout,self.steps))
+        self.schedule_check()
+
+    def check_value(self,value):
+        if self.max_output is not None and value_size(value) > self.max_output:
+            raise Exception("Evaluation stopped: a {} of size {} is over the output budget of {}".format(VALUE_TYPE_NAMES.get(type(value),"value"),value_size(value),self.max_output))
+
+    def add_output(self,size):
+        self.output += size
+        if self.max_output is not None and self.output > self.max_output:
+            raise Exception("Output stopped: more than {} characters".format(self.max_output))
+
+
+class BudgetWriter:
+    def __init__(self,output,budget):
+        self.output = output
+        self.budget = budget
+
+    def write(self,text):
+        self.budget.add_output(len(text))
+        return self.output.write(text)
+
+
+#### COMPILER ####
+
+# how a compiled block runs each of its statements
+STATEMENT_VALUE = 0
+STATEMENT_EFFECT = 1
+STATEMENT_CONTROL = 2
+
+
+class Compiler:
+    def __init__(self):
+        self.loop_depth = 0
+
+    def compile_function(self,func_node):
+        block = self.compile_block(func_node.body_node)
+        slot_count = func_node.slot_count
+
+        def function(interpreter,this):
+            variables = [UNASSIGNED] * slot_count
+            results = []
+            block(interpreter,this,variables,results)
+            return function_result(results)
+        return function
+
+    def compile_block(self,statements):
+        # a block adds the values of its statements to results and returns BREAK, CONTINUE, RETURN or None
+        compiled = []
+        for statement in statements:
+            statement_type = type(statement)
+            if statement_type == IfNode:
+                compiled.append((STATEMENT_CONTROL,self.compile_if(statement)))
+            elif statement_type == BreakNode:
+                compiled.append((STATEMENT_CONTROL,lambda interpreter,this,variables,results: BREAK))
+            elif statement_type == ContinueNode:
+                compiled.append((STATEMENT_CONTROL,lambda interpreter,this,variables,results: CONTINUE))
+            elif statement_type == ReturnNode:
+                compiled.append((STATEMENT_CONTROL,self.compile_return(statement)))
+            elif statement_type in (ForNode,WhileNode) and statement.should_return_null:
+                compiled.append((STATEMENT_CONTROL,self.compile_loop(statement)))
+            elif statement_type == VarAssignNode:
+                compiled.append((STATEMENT_EFFECT,self.compile(statement)))
+            else:
+                compiled.append((STATEMENT_VALUE,self.compile(statement)))
+
+        def block(interpreter,this,variables,results):
+            for kind,statement in compiled:
+                if kind == STATEMENT_VALUE:
+                    results.append(statement(interpreter,this,variables))
+                elif kind == STATEMENT_EFFECT:
+                    statement(interpreter,this,variables)
+                else:
+                    signal = statement(interpreter,this,variables,results)
+                    if signal is not None:
+                        return signal
+            return None
+        return block
+
+    def compile_return(self,node):
+        value = self.compile(node.node_to_return)
+
+        def leave(interpreter,this,variables,results):
+            results.append(value(interpreter,this,variables))
+            return RETURN
+        return leave
+
+    def compile_if(self,node):
+        cases = [(self.compile(condition),self.compile_block(body)) for condition,body in node.cases]
+        else_block = self.compile_block(node.else_case) if node.else_case is not None else None
+
+        def choose(interpreter,this,variables,results):
+            for condition,block in cases:
+                if condition(interpreter,this,variables):
+                    return block(interpreter,this,variables,results)
+            if else_block is not None:
+                return else_block(interpreter,this,variables,results)
+            return None
+        return choose
+
+    def compile_loop(self,node):
+        self.loop_depth += 1
+        try:
+            body = self.compile_block(node.body_node)
+        finally:
+            self.loop_depth -= 1
+        keep_values = not node.should_return_null
+        slot = node.slot if type(node) == ForNode else None
+
+        # a loop written as a statement takes the results of its block and returns a signal,
+        # only a return inside it is passed on, with its value added to the results
+        def run(interpreter,this,variables,values,condition,results):
+            budget = interpreter.budget
+            size_limit = budget.max_output if budget is not None else None
+            items = []
+            iteration = []
+            for value in values:
+                if condition is None:
+                    variables[slot] = value
+                elif not condition(interpreter,this,variables):
+                    break
+                if budget is not None:
+                    budget.steps += 1
+                    if budget.steps >= budget.next_check:
+                        budget.check()
+                signal = body(interpreter,this,variables,iteration)
+                if signal is RETURN:
+                    results.append(iteration[-1])
+                    return RETURN
+                if iteration:
+                    if keep_values:
+                        item = function_result(iteration)
+                        items.append(item)
+                        if size_limit is not None and (len(items) > size_limit or type(item) in SIZED_TYPES and len(item) > size_limit):
+                            budget.check_value(items)
+                            budget.check_value(item)
+                    iteration.clear()
+                if signal is BREAK:
+                    break
+            return items if keep_values else None
+
+        if type(node) == WhileNode:
+            condition = self.compile(node.condition_node)
+            if not keep_values:
+                return lambda interpreter,this,variables,results: run(interpreter,this,variables,itertools.repeat(None),condition,results)
+            return lambda interpreter,this,variables: run(interpreter,this,variables,itertools.repeat(None),condition,None)
+
+        start = self.compile(node.start_value_node)
+        end = self.compile(node.end_value_node) if node.end_value_node is not None else None
+        step = self.compile(node.step_value_node) if node.step_value_node is not None else None
+
+        def run_for(interpreter,this,variables,results=None):
+            values = loop_values(start(interpreter,this,variables),
+                end(interpreter,this,variables) if end is not None else None,
+                step(interpreter,this,variables) if step is not None else None)
+            return run(interpreter,this,variables,values,None,results)
+        return run_for
+
+    def compile(self,node):
+        node_type = type(node)
+
+        if node_type == VarAssignNode:
+            value = self.compile(node.value_node)
+            slot = node.slot
+
+            if self.loop_depth:
+                # values grown in a loop are held to the output budget as they grow
+                def assign_in_loop(interpreter,this,variables):
+                    result = variables[slot] = value(interpreter,this,variables)
+                    if interpreter.size_limit is not None and type(result) in SIZED_TYPES and len(result) > interpreter.size_limit:
+                        interpreter.budget.check_value(result)
+                return assign_in_loop
+
+            def assign(interpreter,this,variables):
+                variables[slot] = value(interpreter,this,variables)
+            return assign
+
+        if node_type in (ForNode,WhileNode):
+            return self.compile_loop(node)
+
+        if node_type == VarAccessNode:
+            slot = node.slot
+
+            def access(interpreter,this,variables):
+                value = variables[slot]
+                if value is UNASSIGNED:
+                    raise Exception("Variable not assigned")
+                return value
+            return access
+
+        if node_type == BinOpNode:
+            # long formulas lean left, so the left operands are followed in a loop instead of recursing
+            steps = []
+            while type(node) == BinOpNode:
+                steps.append(node)
+                node = node.left_node
+            first = self.compile(node)
+            operations = []
+            for step in reversed(steps):
+                if step.op_tok.type not in BINARY_OPERATIONS:
+                    raise Exception("Operation Failure")
+                operations.append((BINARY_OPERATIONS[step.op_tok.type],self.compile(step.right_node)))
+
+            if len(operations) == 1:
+                operation,right = operations[0]
+                return lambda interpreter,this,variables: operation(first(interpreter,this,variables),right(interpreter,this,variables))
+
+            def chain(interpreter,this,variables):
+                value = first(interpreter,this,variables)
+                for operation,right in operations:
+                    value = operation(value,right(interpreter,this,variables))
+                return value
+            return chain
+
+        if node_type == UnaryOpNode:
+            operand = self.compile(node.node)
+            return lambda interpreter,this,variables: negate_value(operand(interpreter,this,variables))
+
+        if node_type == ReturnNode:
+            return self.compile(node.node_to_return)
+
+        if node_type == ThisNode:
+            path = node.after_identifier
+            return lambda interpreter,this,variables: interpreter.resolve_this(this,path)
+
+        if node_type in (ObjectNode,ArrayNode,RawNode):
+            return lambda interpreter,this,variables: interpreter.to_python(node)
+
+        constant = constant_value(node)
+        if constant is NOT_CONSTANT:
+            constant = None
+        return lambda interpreter,this,variables: constant
+
+
+#### CONSTANT FOLDING ####
+
+NOT_CONSTANT = object()
+
+
+def expression_source(node):
+    node_type = type(node)
+    if node_type == BinOpNode:
+        steps = []
+        while type(node) == BinOpNode:
+            steps.append(node)
+            node = node.left_node
+        source = expression_source(node)
+        power = None
+        for step in reversed(steps):
+            step_power = BINDING_POWERS.get(step.op_tok.type,0)
+            if power is not None and power < step_power:
+                source = "({})".format(source)
+            right = expression_source(step.right_node)
+            if type(step.right_node) == BinOpNode and BINDING_POWERS.get(step.right_node.op_tok.type,0) <= step_power:
+                right = "({})".format(right)
+            source = "{}{}{}".format(source,OPERATOR_SYMBOLS.get(step.op_tok.type,"?"),right)
+            power = step_power
+        return source
+    if node_type == UnaryOpNode:
+        operand = expression_source(node.node)
+        if type(node.node) == BinOpNode:
+            operand = "({})".format(operand)
+        return "-" + operand
+    if node_type == IntegerNode:
+        return str(node.integer)
+    if node_type == FloatNode:
+        return repr(node.number)
+    if node_type == StringNode:
+        return '"{}"'.format(node.string)
+    if node_type == VarAccessNode:
+        return node.var_name_tok
+    if node_type == ThisNode:
+        return "this" + "".join(".{}".format(child.access_node) if type(child.access_node) == str else "[{}]".format(child.access_node) for child in node.after_identifier)
+    if node_type == NoneNode:
+        return "null"
+    if node_type == BinaryNode:
+        return "true" if node.value else "false"
+    return repr(node)
+
+
+def variable_assignments(func_node):
+    # how often every slot is assigned, inside loops and if blocks too, a loop variable counts as assigned twice
+    assignments = {}
+    stack = [func_node]
+    while stack:
+        node = stack.pop()
+        if type(node) == list:
+            stack.extend(node)
+            continue
         if type(node) == VarAssignNode:
+            assignments[node.slot] = assignments.get(node.slot,0) + 1
+        elif type(node) == ForNode:
+            assignments[node.slot] = assignments.get(node.slot,0) + 2
+        if node is not None:
+            for attribute in FUNCTION_CHILD_ATTRIBUTES:
+                child = getattr(node,attribute,None)
+                if child is not None and type(child) not in (str,int,Token):
+                    stack.append(child)
+    return assignments
+
+
+def constant_value(node):
+    node_type = type(node)
+    if node_type == IntegerNode:
+        return node.integer
+    if node_type == FloatNode:
+        return node.number
+    if node_type == StringNode:
+        return node.value()
+    if node_type == NoneNode:
+        return None
+    if node_type == BinaryNode:
+        return node.value
+    return NOT_CONSTANT
+
+
+def constant_node(value):
+    if type(value) == int:
+        return IntegerNode(value)
+    if type(value) == float:
+        # inf and nan have no JSON form, the interpreter reports them
+        if value != value or value in (float("inf"),float("-inf")):
+            return None
+        return FloatNode(value)
+    if type(value) == str:
+        return StringNode(value_to_json(value)[1:-1])
+    if type(value) == bool:
+        return BinaryNode(value)
+    if value is None:
+        return NoneNode()
+    return None
+
+
+class ConstantFolder:
+    def __init__(self):
+        self.folded = []
+        self.function_fields = 0
+        self.static_fields = 0
+
+    def fold(self,root):
+        stack = [(root,ROOT_LABEL)]
+        while stack:
+            node,label = stack.pop()
+            if type(node) == ObjectNode:
+                values = list(node.values)
+                for index,value in enumerate(values):
+                    member_label = (label,node.keys[index])
+                    if type(value) == FuncDefNode:
+                        values[index] = self.fold_function(value,member_label)
+                    else:
+                        stack.append((value,member_label))
+                node.values = tuple(values)
+            elif type(node) == ArrayNode:
+                elements = list(node.object_nodes)
+                for index,element in enumerate(elements):
+                    element_label = (label,index)
+                    if type(element) == FuncDefNode:
+                        elements[index] = self.fold_function(element,element_label)
+                    else:
+                        stack.append((element,element_label))
+                node.object_nodes = tuple(elements)
+        return root
+
+    def fold_function(self,func_node,label):
+        self.function_fields += 1
+        assignments = variable_assignments(func_node)
+
+        constants = {}
+        results = []
+        for statement in func_node.body_node:
+            if type(statement) == VarAssignNode:
+                statement.value_node = self.fold_statement(statement.value_node,constants,label)
+                value = constant_value(statement.value_node)
+                if value is not NOT_CONSTANT and assignments[statement.slot] == 1:
+                    constants[statement.slot] = value
+                    self.folded.append((label,"variable","var {} = {}".format(statement.var_name_tok,expression_source(statement.value_node))))
+            elif type(statement) == ReturnNode:
+                statement.node_to_return = self.fold_statement(statement.node_to_return,constants,label)
+                results.append(constant_value(statement.node_to_return))
+                # the statements after a return never run
+                break
+            else:
+                results.append(NOT_CONSTANT)
+
+        if any(result is NOT_CONSTANT for result in results):
+            return func_node
+        literal = constant_node(function_result(results))
+        if literal is None:
+            return func_node
+        self.static_fields += 1
+        self.folded.append((label,"field","->{{...}} = {}".format(expression_source(literal))))
+        return literal
+
+    def fold_statement(self,node,constants,label):
+        before = expression_source(node)
+        node = self.fold_expression(node,constants)
+        after = expression_source(node)
+        if before != after:
+            self.folded.append((label,"expression","{} = {}".format(before,after)))
+        return node
+
+    def fold_expression(self,node,constants):
+        if type(node) == VarAccessNode and node.slot in constants:
+            return constant_node(constants[node.slot]) or node
+        if type(node) == UnaryOpNode:
+            node.node = self.fold_expression(node.node,constants)
+            value = constant_value(node.node)
+            if type(value) in NUMBER_TYPES:
+                return constant_node(-value) or node
+            return node
+        if type(node) != BinOpNode:
+            return node
+
+        steps = []
+        while type(node) == BinOpNode:
+            steps.append(node)
+            node = node.left_node
+        left = self.fold_expression(node,constants)
+        for step in reversed(steps):
+            step.left_node = left
+            step.right_node = self.fold_expression(step.right_node,constants)
+            left = self.fold_operation(step)
+        return left
+
+    def fold_operation(self,node):
+        left = constant_value(node.left_node)
+        right = constant_value(node.right_node)
+        operation = BINARY_OPERATIONS.get(node.op_tok.type)
+        if left is NOT_CONSTANT or right is NOT_CONSTANT or operation is None:
+            return node
+        try:
+            value = operation(left,right)
+        except Exception:
+            # errors such as a division by 0 are raised by the interpreter when the field runs
+            return node
+        return constant_node(value) or node
+
+    def report(self):
+        lines = ["{}: {} {}".format(label_text(label),kind,description) for label,kind,description in self.folded]
+        lines.append("{} of {} function fields are static".format(self.static_fields,self.function_fields))
+        return lines
 
-            if type(node.value_node) == list:
 
-                globalVariableTable.append([node.var_name_tok,self.f_interp(node.value_node[0],this)])
+class ObjectContext:
+    def __init__(self,members=()):
+        self.members = {}
+        for member in members:
+            self.add(member)
 
+    def add(self,member):
+        self.members[member.name.string] = member.value_token
+
+    def lookup(self,name):
+        if name not in self.members:
+            raise Exception("this.{} is not defined".format(name))
+        return self.members[name]
+
+
+class Interpreter():
+    def __init__(self,node,compiled=True,workers=None,pool="thread",budget=None):
+        if pool not in FIELD_POOLS:
+            raise Exception("Unknown pool {}, expected one of {}".format(pool,", ".join(FIELD_POOLS)))
+        self.node = node
+        self.compiled = compiled
+        # function fields run on a pool of this many workers, independent ones at the same time
+        self.workers = workers
+        self.pool = pool
+        self.budget = budget
+        self.size_limit = budget.max_output if budget is not None else None
+        self.contexts = {}
+        self.function_results = {}
+        self.evaluating = set()
+
+    def context_for(self,object_node):
+        context = self.contexts.get(id(object_node))
+        if context is None:
+            context = self.contexts[id(object_node)] = ObjectContext()
+            context.members.update(zip(object_node.keys,object_node.values))
+        return context
+
+    def evaluate_function(self,func_node,context):
+        key = id(func_node)
+        if key in self.function_results:
+            return self.function_results[key]
+        if key in self.evaluating:
+            raise Exception("Circular this reference between function fields")
+
+        if self.budget is not None:
+            self.budget.step()
+        self.evaluating.add(key)
+        try:
+            if self.compiled:
+                result = self.compile_function(func_node)(self,context)
+            else:
+                result = self.walk_function(func_node,context)
+        finally:
+            self.evaluating.discard(key)
+        self.function_results[key] = result
+        return result
+
+    def walk_function(self,func_node,context):
+        return self.f_interp(func_node,context,Scope(func_node.slot_count))
+
+    def compile_function(self,func_node):
+        function = func_node.compiled
+        if function is None:
+            function = func_node.compiled = Compiler().compile_function(func_node)
+        return function
+
+    def function_value(self,func_node,context):
+        return self.evaluate_function(func_node,context)
+
+    def to_python(self,node,context=None):
+        # containers are filled from an explicit stack of (node, context, container, key)
+        result = [None]
+        stack = [(node,context,result,0)]
+        while stack:
+            node,context,target,key = stack.pop()
+            node_type = type(node)
+            if node_type == ObjectNode:
+                values = node.values
+                value = {}
+                member_context = None
+                if any(type(member) == FuncDefNode for member in values):
+                    member_context = self.context_for(node)
+                names = [decode_string(key) for key in node.keys]
+                for name in names:
+                    value[name] = None
+                # pushed in reverse so members are filled in order and a repeated name keeps its last value
+                for index in range(len(values)-1,-1,-1):
+                    stack.append((values[index],member_context,value,names[index]))
+            elif node_type == ArrayNode:
+                elements = node.object_nodes
+                value = [None] * len(elements)
+                for index in range(len(elements)-1,-1,-1):
+                    stack.append((elements[index],None,value,index))
+            elif node_type == StringNode:
+                value = node.value()
+            elif node_type == IntegerNode:
+                value = node.integer
+            elif node_type == FloatNode:
+                value = node.number
+            elif node_type == BinaryNode:
+                value = node.value
+            elif node_type == FuncDefNode:
+                value = self.function_value(node,context)
+            elif node_type == RawNode:
+                value = node.value()
+            elif node_type in VALUE_TYPE_NAMES:
+                value = node
+            else:
+                value = None
+            target[key] = value
+        return result[0]
+
+    def context_to_python(self,context):
+        value = {}
+        for name,member_node in context.members.items():
+            if type(member_node) == FuncDefNode and id(member_node) in self.evaluating:
+                continue
+            value[name] = self.to_python(member_node,context)
+        return value
+
+    def resolve_this(self,context,path):
+        if context is None:
+            raise Exception("this is only available inside an object")
+        if not path:
+            return self.context_to_python(context)
+
+        current = context.lookup(path[0].access_node)
+        # a context can also hold runtime values, such as the fields of a template record
+        is_node = type(current) not in VALUE_TYPE_NAMES
+        for child in path[1:]:
+            key = child.access_node
+            if is_node and type(current) == FuncDefNode:
+                current = self.function_value(current,context)
+                is_node = False
+            elif is_node and type(current) == RawNode:
+                current = current.value()
+                is_node = False
+
+            if not is_node:
+                current = current[key]
+            elif type(current) == ObjectNode:
+                context = self.context_for(current)
+                current = context.lookup(key)
+            elif type(current) == ArrayNode:
+                current = current.object_nodes[key]
             else:
+                raise Exception("Can't access {} of {}".format(key,current))
+
+        if is_node:
+            return self.to_python(current,context)
+        return current
+
+    def evaluate_functions(self):
+        if self.budget is not None:
+            self.budget.start()
+        plan = EvaluationPlan(self.node)
+        if self.workers is not None and self.workers > 1 and len(plan.order) > 1:
+            self.evaluate_functions_parallel(plan)
+            return plan
+        for func_node in plan.order:
+            self.evaluate_planned(plan,func_node)
+        return plan
+
+    def evaluate_planned(self,plan,func_node):
+        owner = plan.owners[id(func_node)]
+        return self.evaluate_function(func_node,self.context_for(owner) if owner is not None else None)
+
+    def evaluate_functions_parallel(self,plan):
+        waves = evaluation_waves(plan)
+        if self.pool == "process":
+            indexes = {id(func_node): index for index,func_node in enumerate(plan.functions)}
+            owners = [plan.owners[id(func_node)] for func_node in plan.functions]
+            # every process counts steps against its own copy of the budget, the deadline is shared
+            executor = ProcessPoolExecutor(max_workers=self.workers,initializer=start_field_worker,initargs=(self.node,plan.functions,owners,self.compiled,self.budget))
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            # created up front, so threads only read the contexts of the fields they run
+            for func_node in plan.functions:
+                if plan.owners[id(func_node)] is not None:
+                    self.context_for(plan.owners[id(func_node)])
+
+        with executor:
+            for wave in waves:
+                if len(wave) == 1:
+                    self.evaluate_planned(plan,wave[0])
+                    continue
+                if self.pool == "process":
+                    dependency_results = [[(indexes[id(dependency)],self.function_results[id(dependency)]) for dependency in plan.dependencies[id(func_node)]] for func_node in wave]
+                    chunk_size = max(1,len(wave) // (self.workers * 4))
+                    results = executor.map(evaluate_field_in_worker,[indexes[id(func_node)] for func_node in wave],dependency_results,chunksize=chunk_size)
+                else:
+                    results = executor.map(lambda func_node: self.evaluate_planned(plan,func_node),wave)
+                # merged in source order, the first field that fails raises its error
+                for func_node,result in zip(wave,results):
+                    self.function_results[id(func_node)] = result
+
+    def evaluate(self):
+        self.traced_evaluate_functions()
+        with trace_phase("write"):
+            return self.to_python(self.node)
+
+    def evaluate_lazy(self):
+        # nothing is evaluated up front, function fields run when the returned view reads them
+        if self.budget is not None:
+            self.budget.start()
+        return lazy_value(self,self.node,None)
+
+    def execute(self,output=None):
+        self.traced_evaluate_functions()
+        with trace_phase("write"):
+            if output is not None:
+                self.interp(self.node,output)
+                return None
+            return self.render(self.node)
+
+    def traced_evaluate_functions(self):
+        with trace_phase("interpret"):
+            plan = self.evaluate_functions()
+        if tracer is not None:
+            tracer.count("interpret",len(plan.order))
+            tracer.event(TRACE_INFO,"evaluated {} function fields",len(plan.order))
+        return plan
+    
+    def f_interp(self,node,this=None,scope=None):
+        if tracer is not None:
+            tracer.event(TRACE_DEBUG,"node {}",node)
+
+        if type(node) == FuncDefNode:
+            results = []
+            self.walk_block(node.body_node,this,scope,results)
+            return function_result(results)
+            
+        if type(node) == VarAssignNode:
 
-                globalVariableTable.append([node.var_name_tok,self.f_interp(node.value_node,this)])
-            print("a",node,self.f_interp(node.value_node,this))
-            return ""
+            scope.values[node.slot] = self.f_interp(node.value_node,this,scope)
+            if tracer is not None:
+                tracer.event(TRACE_DEBUG,"assign {} = {!r}",node.var_name_tok,scope.values[node.slot])
+            if self.budget is not None:
+                self.budget.check_value(scope.values[node.slot])
+            return None
+
+        if type(node) in (ForNode,WhileNode):
+            return self.walk_loop(node,this,scope)
         
         if type(node) == BinOpNode:
 
-            left = self.f_interp(node.left_node,this)
-            right = self.f_interp(node.right_node,this)
-            print(left,right)
-
-            if node.op_tok.type == T_PLUS:
-                if type(left) == str or type(right) == str:
-                    print("one of them is string")
-                    try:
-                        left = int(left)
-                        right = int(right)
-                        return left + right
-                    except Exception:
-                        print("except")
-                        left = str(left)
-                        print(node.left_node)
-                        if type(node.left_node) == ThisNode:
-                            left = left[1:-1]
-                        if type(node.right_node) == ThisNode:
-                            left = left[1:-1]
-                        right = str(right)
-                        print(left,right)
-                        return '\"' + str(left + right) + '\"'
-                else:
-                    return left + right
-            
-            elif node.op_tok.type == T_MINUS:
-                if type(left) == str or type(right == str):
-                    raise Exception("Can't subtract str")
-                else:
-                    return left - right
-            
-            elif node.op_tok.type == T_DIV:
-                if right == 0:
-                    raise Exception("Division by 0 not allowed")
-                if type(left) == str or type(right == str):
-                    raise Exception("Can't div str")
-                else:
-                    return left / right
-            
-            elif node.op_tok.type == T_MUL:
-                if type(left) == str or type(right == str):
-                    try:
-                        left = int(left)
-                        right = int(right)
-                        return left * right
-                    except Exception:
-                        raise Exception("Can't multiply str")
-                else:
-                    return left * right
-            
-            else:
-                raise Exception("Operation Failure")
+            steps = []
+            while type(node) == BinOpNode:
+                steps.append(node)
+                node = node.left_node
+            left = self.f_interp(node,this,scope)
+            for step in reversed(steps):
+                right = self.f_interp(step.right_node,this,scope)
+                if tracer is not None:
+                    tracer.event(TRACE_DEBUG,"{!r} {} {!r}",left,OPERATOR_SYMBOLS.get(step.op_tok.type,"?"),right)
+
+                operation = BINARY_OPERATIONS.get(step.op_tok.type)
+                if operation is None:
+                    raise Exception("Operation Failure")
+                left = operation(left,right)
+            return left
+
+        if type(node) == UnaryOpNode:
+            return negate_value(self.f_interp(node.node,this,scope))
        
         if type(node) == IntegerNode:
             return node.integer
 
+        if type(node) == FloatNode:
+            return node.number
+
         if type(node) == StringNode:
-            return str(node.string)
+            return node.value()
 
         if type(node) == ReturnNode:
-            returning = self.f_interp(node.node_to_return,this)
+            returning = self.f_interp(node.node_to_return,this,scope)
             return returning
         
         if type(node) == NoneNode:
-            return "null"
+            return None
         
         if type(node) == ThisNode:
-            thisObj = json.loads(str(this[:-1])+'}')
-
-            for child in node.after_identifier:
-                thisObj = thisObj[child.access_node]
-            print(type(thisObj))
-            if type(thisObj) == str:
-                print("this is str")
-                return '"'+thisObj+'"'
-            elif type(thisObj) == int:
-                return thisObj
-            print(thisObj)
-            return json.dumps(thisObj)
+            thisObj = self.resolve_this(this,node.after_identifier)
+            if tracer is not None:
+                tracer.event(TRACE_DEBUG,"{} = {!r}",expression_source(node),thisObj)
+            return thisObj
         
         if type(node) == VarAccessNode:
-            for var_tuple in globalVariableTable:
-                if var_tuple[0] == node.var_name_tok:
-                    return var_tuple[1]
-            raise Exception("Variable not assigned")
+            value = scope.values[node.slot]
+            if value is UNASSIGNED:
+                raise Exception("Variable not assigned")
+            return value
 
         if type(node) == BinaryNode:
-            if node.value == True:
-                return "true"
-            elif node.value == False:
-                return "false"
-        
-        return return_str
+            return node.value
 
-    def interp(self,node,current_str=None):
-        str = ""
+        if type(node) in (ObjectNode,ArrayNode,RawNode):
+            return self.to_python(node)
         
-        if type(node) == ObjectNode:
-            str += "{"
-            for nvp_node in node.name_value_pair_nodes:
-                str += self.interp(nvp_node,str)
-            str = str[:-1]
-            str += "}"
-        elif type(node) == ArrayNode:
-            str += "["
-            for index, object_node in enumerate(node.object_nodes):
-                str += self.interp(object_node)
-                if index+1 != len(node.object_nodes):
-                    str+=","
-            # str = str[:-1]
-            str += "]"
-        elif type(node) == NameValuePairNode:
-            str += '{}:{},'.format(self.interp(node.name),self.interp(node.value_token,current_str))
-        elif type(node) == StringNode:
-            str += '\"{}\"'.format(node.string)
-        elif type(node) == IntegerNode:
-            str += "{}".format(node.integer)
-        elif type(node) == BinaryNode:
-            if node.value == True:
-                str += "true"
+        return None
+
+    def walk_block(self,statements,this,scope,results):
+        for statement in statements:
+            statement_type = type(statement)
+            if statement_type == IfNode:
+                signal = self.walk_block(self.chosen_case(statement,this,scope),this,scope,results)
+                if signal is not None:
+                    return signal
+            elif statement_type == BreakNode:
+                return BREAK
+            elif statement_type == ContinueNode:
+                return CONTINUE
+            elif statement_type == ReturnNode:
+                results.append(self.f_interp(statement,this,scope))
+                return RETURN
+            elif statement_type in (ForNode,WhileNode) and statement.should_return_null:
+                signal = self.walk_loop(statement,this,scope,results)
+                if signal is not None:
+                    return signal
+            elif statement_type == VarAssignNode:
+                self.f_interp(statement,this,scope)
             else:
-                str += "false"
-        elif type(node) == NoneNode:
-            str += "null"
-        elif type(node) == FuncDefNode:
-            globalVariableTable.clear()
-            str += "{}".format(self.f_interp(node,current_str))
-            
-        return str
+                results.append(self.f_interp(statement,this,scope))
+        return None
+
+    def chosen_case(self,node,this,scope):
+        for condition,body in node.cases:
+            if self.f_interp(condition,this,scope):
+                return body
+        return node.else_case or []
+
+    def walk_loop(self,node,this,scope,results=None):
+        if type(node) == ForNode:
+            values = loop_values(self.f_interp(node.start_value_node,this,scope),
+                self.f_interp(node.end_value_node,this,scope) if node.end_value_node is not None else None,
+                self.f_interp(node.step_value_node,this,scope) if node.step_value_node is not None else None)
+        else:
+            values = itertools.repeat(None)
+
+        items = []
+        for value in values:
+            if type(node) == ForNode:
+                scope.values[node.slot] = value
+            elif not self.f_interp(node.condition_node,this,scope):
+                break
+            if self.budget is not None:
+                self.budget.step()
+            iteration = []
+            signal = self.walk_block(node.body_node,this,scope,iteration)
+            if signal is RETURN:
+                results.append(iteration[-1])
+                return RETURN
+            if iteration and not node.should_return_null:
+                items.append(function_result(iteration))
+                if self.budget is not None:
+                    self.budget.check_value(items[-1])
+                    self.budget.check_value(items)
+            if signal is BREAK:
+                break
+        return items if not node.should_return_null else None
+
+    def interp_stream(self,node_type,members,output,referenced=None):
+        if self.budget is not None:
+            self.budget.start()
+        if node_type is ArrayNode:
+            output.write("[")
+            for index,element in enumerate(members):
+                if index:
+                    output.write(",")
+                self.interp(element,output)
+            output.write("]")
+        elif node_type is ObjectNode:
+            # only members that a function can reach through this.<name> are kept; a function that reads
+            # a member further down waits, with the members after it so their order stays, until that member is read
+            context = ObjectContext()
+            waiting = deque()
+            written = 0
+            output.write("{")
+            for member in members:
+                if referenced is None or member.name.string in referenced or type(member.value_token) == FuncDefNode:
+                    context.add(member)
+                waiting.append(member)
+                while waiting and self.stream_ready(waiting[0].value_token,context,set()):
+                    if written:
+                        output.write(",")
+                    self.interp(waiting.popleft(),output,context)
+                    written += 1
+            # members that never came up are reported by the functions reading them
+            for member in waiting:
+                if written:
+                    output.write(",")
+                self.interp(member,output,context)
+                written += 1
+            output.write("}")
+
+    def stream_ready(self,node,context,visiting):
+        if type(node) != FuncDefNode or id(node) in self.function_results or id(node) in visiting:
+            # a cycle is left to evaluate_function to report
+            return True
+        visiting.add(id(node))
+        for path in function_this_paths(node):
+            # this on its own reads the whole object
+            if not path:
+                return False
+            if path[0] not in context.members or not self.stream_ready(context.members[path[0]],context,visiting):
+                return False
+        return True
+
+    def render(self,node,this=None):
+        writer = ChunkWriter()
+        self.interp(node,writer,this)
+        return writer.getvalue()
+
+    def interp(self,node,output,this=None):
+        if self.budget is not None and self.budget.max_output is not None:
+            output = BudgetWriter(output,self.budget)
+        # an explicit stack of nodes and closing text, so nesting depth is limited by memory and not by recursion
+        write = output.write
+        stack = [(node,this)]
+        while stack:
+            node,this = stack.pop()
+            node_type = type(node)
+
+            if node_type == str:
+                write(node)
+            elif node_type == ObjectNode:
+                keys = node.keys
+                values = node.values
+                context = None
+                if any(type(value) == FuncDefNode for value in values):
+                    context = self.context_for(node)
+                write("{")
+                stack.append(("}",None))
+                for index in range(len(values)-1,-1,-1):
+                    stack.append((values[index],context))
+                    stack.append(((',"' if index else '"') + keys[index] + '":',None))
+            elif node_type == ArrayNode:
+                elements = node.object_nodes
+                write("[")
+                stack.append(("]",None))
+                for index in range(len(elements)-1,-1,-1):
+                    stack.append((elements[index],None))
+                    if index:
+                        stack.append((",",None))
+            elif node_type == NameValuePairNode:
+                write('"' + node.name.string + '":')
+                stack.append((node.value_token,this))
+            elif node_type == StringNode:
+                write('"' + node.string + '"')
+            elif node_type == IntegerNode:
+                write(str(node.integer))
+            elif node_type == FloatNode:
+                write(value_to_json(node.number))
+            elif node_type == BinaryNode:
+                write("true" if node.value == True else "false")
+            elif node_type == NoneNode:
+                write("null")
+            elif node_type == FuncDefNode:
+                write(value_to_json(self.evaluate_function(node,this)))
+            elif node_type == RawNode:
+                node.write_compact(output)
+
+
+class ChunkWriter:
+    def __init__(self):
+        self.chunks = []
+        self.write = self.chunks.append
+
+    def getvalue(self):
+        return "".join(self.chunks)
     
 
-def execute(file_path):
+#### LAZY VALUES ####
+
+def lazy_value(interpreter,node,context):
+    # containers become views over their nodes, a function field runs when it is read
+    node_type = type(node)
+    if node_type == ObjectNode:
+        return LazyObject(interpreter,node)
+    if node_type == ArrayNode:
+        return LazyArray(interpreter,node)
+    if node_type == FuncDefNode:
+        return interpreter.function_value(node,context)
+    return interpreter.to_python(node,context)
+
+
+class LazyObject(Mapping):
+    def __init__(self,interpreter,node):
+        self.interpreter = interpreter
+        self.node = node
+        # like to_python, a repeated name keeps its first position and its last value
+        self.indexes = {}
+        for index,key in enumerate(node.keys):
+            self.indexes[decode_string(key)] = index
+        self.context = None
+        if any(type(value) == FuncDefNode for value in node.values):
+            self.context = interpreter.context_for(node)
+        self.cache = {}
+
+    def __getitem__(self,name):
+        if name in self.cache:
+            return self.cache[name]
+        value = self.cache[name] = lazy_value(self.interpreter,self.node.values[self.indexes[name]],self.context)
+        return value
+
+    def __iter__(self):
+        return iter(self.indexes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __contains__(self,name):
+        return name in self.indexes
+
+    def to_python(self):
+        return self.interpreter.to_python(self.node)
+
+    def __repr__(self):
+        return f"LazyObject({list(self.indexes)})"
+
+
+class LazyArray(Sequence):
+    def __init__(self,interpreter,node):
+        self.interpreter = interpreter
+        self.node = node
+        self.cache = {}
+
+    def __getitem__(self,index):
+        if type(index) == slice:
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+            if index < 0:
+                raise IndexError("lazy array index out of range")
+        if index in self.cache:
+            return self.cache[index]
+        value = self.cache[index] = lazy_value(self.interpreter,self.node.object_nodes[index],None)
+        return value
+
+    def __len__(self):
+        return len(self.node.object_nodes)
+
+    def __eq__(self,other):
+        if type(other) in (list,LazyArray):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def to_python(self):
+        return self.interpreter.to_python(self.node)
+
+    def __repr__(self):
+        return f"LazyArray({len(self)} elements)"
+
+
+LAZY_TYPES = (LazyObject,LazyArray)
+
+
+#### PATH SELECTION ####
+
+# subtrees nested up to this many levels are stepped over by one regex match, deeper ones a level at a time
+SKIM_DEPTH = 4
+
+
+def nested_pattern(depth):
+    # strings are quote to quote like in the lexer, so brackets inside them don't count
+    level = r'(?:[^{}\[\]"]++|"[^"]*+")'
+    for _ in range(depth):
+        level = r'(?:[^{}\[\]"]++|"[^"]*+"|\{%s*+\}|\[%s*+\])' % (level,level)
+    return r'[{\[]%s*+[}\]]' % level
+
+
+SKIM_SOURCES = {
+    "space": r'[ \t\r\n]*',
+    "separators": r'[ \t\r\n,]*',
+    "container": nested_pattern(SKIM_DEPTH),
+    "bracket": r'"[^"]*"|[{}\[\]]',
+    # a name followed by ':' starts the next member, members don't need a ',' between them
+    "value_end": r'("[^"]*"(?=[ \t\r\n]*:))|"[^"]*"|[{\[]|[,}\]]',
+    "arrow": r'->[ \t\r\n]*',
+    # a whole member in one match: its name, then a container, a function or a value without brackets
+    "whole_member": r'[ \t\r\n,]*"([^"]*)"[ \t\r\n]*:[ \t\r\n]*((?:->[ \t\r\n]*)?' + nested_pattern(SKIM_DEPTH)
+        + r'|(?:[^"{}\[\],]++|"[^"]*+"(?![ \t\r\n]*:))*+(?=[,}\]"]|\Z))',
+    "member": r'[ \t\r\n,]*(?:"([^"]*)"[ \t\r\n]*:[ \t\r\n]*|([}\]]))',
+    "element": r'[ \t\r\n,]*([}\]])?',
+}
+SKIM_PATTERNS = {
+    str: {name: re.compile(source) for name,source in SKIM_SOURCES.items()},
+    bytes: {name: re.compile(source.encode("ascii")) for name,source in SKIM_SOURCES.items()},
+}
+SELECT_PATTERN = re.compile(r'\.?([^.\[\]"]+)|\[([0-9]+)\]|\["([^"]*)"\]')
+
+
+def parse_select(select):
+    # "a.b[3].c" or '["a.b"].c' into ["a", "b", 3, "c"]
+    path = []
+    position = 0
+    while position < len(select):
+        match = SELECT_PATTERN.match(select,position)
+        if match is None:
+            raise Exception("Can't read the selection '{}' at {}".format(select,position))
+        name,index,quoted = match.groups()
+        path.append(int(index) if index is not None else quoted if quoted is not None else name)
+        position = match.end()
+    return path
+
+
+def path_text(path):
+    return "".join("[{}]".format(key) if type(key) == int else ("." if index else "") + key for index,key in enumerate(path))
+
+
+class Skimmer:
+    # finds members and elements in the source without lexing it, a value that is not needed
+    # is stepped over by matching its brackets outside of strings
+    def __init__(self,source):
+        self.source = source
+        self.is_text = type(source) == str
+        self.patterns = SKIM_PATTERNS[str if self.is_text else bytes]
+        self.quote = '"' if self.is_text else b'"'
+        self.opening = "{[" if self.is_text else b"{["
+
+    def skip_space(self,position):
+        return self.patterns["space"].match(self.source,position).end()
+
+    def find_key(self,key,start,end):
+        quoted = '"' + key + '"'
+        return self.source.find(quoted if self.is_text else quoted.encode("utf-8"),start,end)
+
+    def skip_separators(self,position):
+        return self.patterns["separators"].match(self.source,position).end()
+
+    def is_container(self,position):
+        character = self.source[position:position+1]
+        return len(character) == 1 and character in self.opening
+
+    def container_end(self,start):
+        source = self.source
+        container = self.patterns["container"].match
+        match = container(source,start)
+        if match is not None:
+            return match.end()
+
+        bracket = self.patterns["bracket"].search
+        depth = 0
+        position = start
+        while True:
+            match = bracket(source,position)
+            if match is None:
+                raise Exception("Expected the container at {} to be closed".format(start))
+            position = match.end()
+            token = match.group()[:1]
+            if token == self.quote:
+                continue
+            if token in self.opening:
+                if depth:
+                    child = container(source,match.start())
+                    if child is not None:
+                        position = child.end()
+                        continue
+                depth += 1
+            else:
+                depth -= 1
+                if not depth:
+                    return position
+
+    def value_end(self,position):
+        # like the parser, a container or a function ends with its closing bracket
+        if self.is_container(position):
+            return self.container_end(position)
+        arrow = self.patterns["arrow"].match(self.source,position)
+        if arrow is not None and self.is_container(arrow.end()):
+            return self.container_end(arrow.end())
+
+        search = self.patterns["value_end"].search
+        while True:
+            match = search(self.source,position)
+            if match is None:
+                raise Exception("Expected ',', '}}' or ']' after the value at {}".format(position))
+            token = match.group()[:1]
+            if match.group(1) is not None:
+                return match.start()
+            if token == self.quote:
+                position = match.end()
+            elif token in self.opening:
+                position = self.container_end(match.start())
+            else:
+                return match.start()
+
+    def next_member(self,position,is_object,lazy):
+        # [name as written or None, value start, value end] of the member at position, None after the last one;
+        # with lazy the value end is left as None
+        source = self.source
+        if not is_object:
+            match = self.patterns["element"].match(source,position)
+            if match.group(1) is not None:
+                return None
+            return [None,match.end(),None if lazy else self.value_end(match.end())]
+
+        if not lazy:
+            match = self.patterns["whole_member"].match(source,position)
+            if match is not None:
+                key = match.group(1) if self.is_text else match.group(1).decode("utf-8")
+                return [key,match.start(2),match.end(2)]
+        match = self.patterns["member"].match(source,position)
+        if match is None:
+            raise Exception("Expected a member name at {}".format(position))
+        if match.group(2) is not None:
+            return None
+        key = match.group(1) if self.is_text else match.group(1).decode("utf-8")
+        return [key,match.end(),None if lazy else self.value_end(match.end())]
+
+
+class SkimmedContainer:
+    # an object or array of the source whose members are only parsed when they are needed
+    def __init__(self,skimmer,start,end):
+        self.skimmer = skimmer
+        # end bounds the text of the container, it can lie past the closing bracket
+        self.end = end
+        self.is_object = skimmer.source[start:start+1] in ("{",b"{")
+        # name or index -> [name as written, value start, value end]; a repeated name keeps its first position and last value
+        self.spans = {}
+        self.members = {}
+        self.complete = False
+        self.done = False
+        self.position = start + 1
+        # the member skimmed last when the end of its value isn't known yet
+        self.open_span = None
+
+    def key(self,key):
+        if not self.is_object and type(key) == str and key.isdigit():
+            return int(key)
+        return key
+
+    def finish(self):
+        if self.open_span is not None:
+            self.open_span[2] = self.position = self.skimmer.value_end(self.open_span[1])
+            self.open_span = None
+
+    def skim(self,lazy=False):
+        # with lazy, the value is only stepped over when a later member or its end is needed
+        self.finish()
+        member = self.skimmer.next_member(self.position,self.is_object,lazy)
+        if member is None:
+            self.done = True
+            return None
+        if self.is_object:
+            self.spans[decode_string(member[0])] = member
+        else:
+            self.spans[len(self.spans)] = member
+        if member[2] is None:
+            self.open_span = member
+        else:
+            self.position = member[2]
+        return member
+
+    def span(self,key):
+        if not self.is_object:
+            while type(key) == int and key >= len(self.spans) and not self.done:
+                self.skim(key == len(self.spans))
+            return self.spans.get(key)
+
+        # members before the first place the name is written are stepped over whole, and that place is
+        # looked for again when it was inside one of them
+        target = -1
+        while key not in self.spans and not self.done and type(key) == str:
+            self.finish()
+            if target < self.position:
+                target = self.skimmer.find_key(key,self.position,self.end)
+                if target == -1:
+                    # escapes may still spell the name
+                    self.keys()
+                    break
+            next_key = self.skimmer.skip_separators(self.position)
+            if next_key < target:
+                self.skim()
+            elif next_key == target:
+                member = self.skim(True)
+                if self.skimmer.find_key(key,member[1],self.end) != -1:
+                    # the name is written again, a later member may repeat it
+                    self.keys()
+            else:
+                target = -1
+        return self.spans.get(key)
+
+    def value_end(self,span):
+        if span[2] is None:
+            self.finish()
+        return span[2]
+
+    def keys(self):
+        while not self.done:
+            self.skim()
+        return list(self.spans)
+
+
+class Selector:
+    # builds a tree of the selected value and of what its functions reach through this, nothing else is parsed
+    def __init__(self,source,lexer=DEFAULT_LEXER):
+        self.source = source
+        self.lexer = lexer
+        self.skimmer = Skimmer(source)
+        start = self.skimmer.skip_space(0)
+        if not self.skimmer.is_container(start):
+            raise Exception("Expected an object or an array to select from")
+        self.root = SkimmedContainer(self.skimmer,start,len(source))
+        self.pending = []
+
+    def select(self,path):
+        # the selection has to exist, a missing this path is reported by its function if it runs
+        self.require(self.root,path,True)
+        while self.pending:
+            container,this_path = self.pending.pop()
+            self.require(container,this_path,False)
+        return self.build(self.root)
+
+    def require(self,container,path,strict):
+        for position,key in enumerate(path):
+            key = container.key(key)
+            span = container.span(key)
+            if span is None:
+                if strict:
+                    raise Exception("{} is not defined".format(path_text(path[:position+1])))
+                return
+            member = container.members.get(key)
+            rest = path[position+1:]
+            if type(member) == SkimmedContainer:
+                container = member
+                continue
+            if member is not None:
+                return
+            if rest and self.skimmer.is_container(span[1]):
+                member = container.members[key] = SkimmedContainer(self.skimmer,span[1],span[2] if span[2] is not None else container.end)
+                container = member
+                continue
+            member = container.members[key] = self.parse_span(span[1],container.value_end(span))
+            if type(member) == FuncDefNode and container.is_object:
+                self.pending.extend((container,this_path) for this_path in function_this_paths(member))
+            return
+        self.require_all(container)
+
+    def require_all(self,container):
+        if container.complete:
+            return
+        container.complete = True
+        for key in container.keys():
+            self.require(container,[key],False)
+
+    def parse_span(self,start,end):
+        raw_node = RawNode(self.source,start,end)
+        if raw_node.is_valid():
+            return raw_node
+        # a lone value is parsed as the only element of an array
+        text = self.source[start:end]
+        ast = parse_text("[" + text + "]" if type(text) == str else b"[" + text + b"]",self.lexer)
+        if type(ast) != ArrayNode or len(ast.object_nodes) != 1:
+            raise Exception("Expected one value at {}".format(start))
+        return ast.object_nodes[0]
+
+    def build(self,container):
+        if container.is_object:
+            keys = []
+            values = []
+            for key,span in container.spans.items():
+                member = container.members.get(key)
+                if member is not None:
+                    keys.append(span[0])
+                    values.append(self.build(member) if type(member) == SkimmedContainer else member)
+            return ObjectNode(tuple(keys),tuple(values))
+        # elements that are not needed keep their place as null
+        elements = [NoneNode()] * (max(container.members) + 1 if container.members else 0)
+        for index,member in container.members.items():
+            elements[index] = self.build(member) if type(member) == SkimmedContainer else member
+        return ArrayNode(tuple(elements))
+
+
+def evaluate_selection(source,select,lexer=DEFAULT_LEXER,optimize=True,budget=None):
+    path = parse_select(select) if type(select) == str else list(select)
+    if type(source) != str and lexer != "regex":
+        source = source[:].decode("utf-8")
+    with trace_phase("parse"):
+        ast = Selector(source,lexer).select(path)
+        if optimize:
+            ast = ConstantFolder().fold(ast)
+
+    with trace_phase("interpret"):
+        value = Interpreter(ast,budget=budget).evaluate_lazy()
+        for position,key in enumerate(path):
+            if type(value) in (list,LazyArray) and type(key) == str and key.isdigit():
+                key = int(key)
+            try:
+                value = value[key]
+            except (KeyError,IndexError,TypeError):
+                raise Exception("{} is not defined".format(path_text(path[:position+1])))
+        if type(value) in LAZY_TYPES:
+            value = value.to_python()
+    return value
+
+
+#### DOCUMENT CACHE ####
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+# bumped whenever the pickled AST layout changes
+CACHE_FORMAT = 6
+
+
+class DocumentCache:
+    def __init__(self,directory,max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory,exist_ok=True)
+
+    def key(self,text):
+        digest = hashlib.sha256("{}\0{}\0".format(__version__,CACHE_FORMAT).encode("utf-8"))
+        digest.update(text.encode("utf-8") if type(text) == str else text)
+        return digest.hexdigest()
+
+    def path(self,key):
+        return os.path.join(self.directory,key + ".pickle")
+
+    def load(self,text):
+        path = self.path(self.key(text))
+        try:
+            with open(path,"rb") as cache_file:
+                ast = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except (OSError,EOFError,pickle.UnpicklingError,AttributeError,ImportError):
+            self.remove(path)
+            return None
+        # the modification time is the recency used for eviction
+        os.utime(path)
+        return ast
+
+    def store(self,text,ast):
+        file_descriptor,temp_path = tempfile.mkstemp(dir=self.directory,suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor,"wb") as cache_file:
+                pickle.dump(ast,cache_file,pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path,self.path(self.key(text)))
+        except RecursionError:
+            # pickle recurses into nested nodes, a document this deep is simply parsed again next time
+            self.remove(temp_path)
+            return
+        except BaseException:
+            self.remove(temp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime,stat.st_size,entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _,size,_ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _,size,_ in entries)
+        for _,size,path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for _,_,path in self.entries():
+            self.remove(path)
+
+    def remove(self,path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def parse_text(text,lexer=DEFAULT_LEXER,cache=None,optimize=False):
+    if cache is not None and not isinstance(cache,DocumentCache):
+        cache = DocumentCache(cache)
+    if type(text) != str and lexer != "regex":
+        # only the regex lexer reads bytes
+        text = text[:].decode("utf-8")
+    ast = None
+    if cache is not None:
+        with trace_phase("read"):
+            ast = cache.load(text)
+        if ast is not None and tracer is not None:
+            tracer.event(TRACE_INFO,"parsed document loaded from the cache")
+
+    if ast is None:
+        with trace_phase("parse"):
+            ast = raw_document(text)
+        if ast is None:
+            with trace_phase("lex"):
+                tokens,error = make_tokens(text,lexer)
+            if error:
+                raise error
+            trace_count("lex",len(tokens))
+            with trace_phase("parse"):
+                parser = Parser(tokens,text)
+                ast = parser.parse()
+        elif tracer is not None:
+            tracer.event(TRACE_INFO,"document is plain JSON, passed through")
+        if cache is not None:
+            with trace_phase("write"):
+                cache.store(text,ast)
+
+    if optimize and ast is not None:
+        with trace_phase("parse"):
+            ast = ConstantFolder().fold(ast)
+    return ast
+
+
+# files at least this large are lexed straight from a memory map of their bytes
+MEMORY_MAP_THRESHOLD = 16 * 1024 * 1024
+
+
+def execute(file_path,lexer=DEFAULT_LEXER,stream=False,cache=None,optimize=True,memory_map=None,field_workers=None,field_pool="thread",budget=None,select=None):
+    if stream:
+        unsupported = [name for name,used in (("cache",cache is not None),("lexer",lexer != DEFAULT_LEXER),("memory_map",bool(memory_map)),
+            ("field_workers",field_workers is not None),("select",select is not None)) if used]
+        if unsupported:
+            raise Exception("{} can't be used in stream mode".format(", ".join(unsupported)))
+        return execute_stream(file_path,optimize=optimize,budget=budget)
+
+    if tracer is not None:
+        tracer.event(TRACE_INFO,"execute {}",file_path)
+    if memory_map is None:
+        memory_map = os.path.getsize(file_path) >= MEMORY_MAP_THRESHOLD
+    if memory_map and os.path.getsize(file_path) == 0:
+        # an empty file can't be mapped
+        memory_map = False
+
+    if memory_map:
+        with open(file_path,"rb") as jsonx_file:
+            with mmap.mmap(jsonx_file.fileno(),0,access=mmap.ACCESS_READ) as source:
+                trace_count("read",len(source))
+                execute_source(source,file_path,lexer,cache,optimize,field_workers,field_pool,budget,select)
+        return
+
     with open(file_path,"r") as jsonx_file:
-        my_str = jsonx_file.read()
-        lexer = Lexer("",my_str)
-        tokens,error = lexer.make_tokens()
-        parser = Parser(tokens)
-        ast = parser.parse()
-        interpreter = Interpreter(ast)
-        jsontxt = interpreter.execute()
+        with trace_phase("read"):
+            my_str = jsonx_file.read()
+        trace_count("read",len(my_str))
+        execute_source(my_str,file_path,lexer,cache,optimize,field_workers,field_pool,budget,select)
+
 
-        # print("EXECUTE: ",jsontxt)
-        # jsonObj = json.loads(jsontxt)
+def execute_source(source,file_path,lexer=DEFAULT_LEXER,cache=None,optimize=True,field_workers=None,field_pool="thread",budget=None,select=None):
+    if select is not None:
+        # only the selected value is written, the rest of the document is skimmed and not evaluated
+        value = evaluate_selection(source,select,lexer,optimize,budget)
+        with replaced_file(get_json_file_name(file_path)) as json_file:
+            with trace_phase("write"):
+                json_file.write(value_to_json(value))
+        return
 
-        json_file_path = get_json_file_name(file_path)
+    ast = parse_text(source,lexer,cache,optimize)
+    interpreter = Interpreter(ast,workers=field_workers,pool=field_pool,budget=budget)
+    # function fields are evaluated before the output is opened, so a failing document writes nothing
+    interpreter.traced_evaluate_functions()
 
-        with open(json_file_path, "w+") as json_file:
-            json_file.write(jsontxt)
+    json_file_path = get_json_file_name(file_path)
+
+    with replaced_file(json_file_path,OUTPUT_BUFFER_SIZE) as json_file:
+        with trace_phase("write"):
+            interpreter.interp(interpreter.node,json_file)
 
 def get_json_file_name(file_path):
     file_name = file_path[:file_path.rfind(".")]
     return file_name + ".json"
+
+
+@contextlib.contextmanager
+def replaced_file(path,buffering=-1):
+    # output goes to a temporary file next to path, which takes its place only once everything was written
+    temp_path = "{}.{}.tmp".format(path,os.getpid())
+    try:
+        with open(temp_path,"w",buffering=buffering) as output:
+            yield output
+        os.replace(temp_path,path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def loads(text,lexer=DEFAULT_LEXER,cache=None,optimize=True,field_workers=None,field_pool="thread",budget=None,lazy=False,select=None):
+    trace_count("read",len(text))
+    if select is not None:
+        return evaluate_selection(text,select,lexer,optimize,budget)
+    ast = parse_text(text,lexer,cache,optimize)
+    interpreter = Interpreter(ast,workers=field_workers,pool=field_pool,budget=budget)
+    if lazy:
+        return interpreter.evaluate_lazy()
+    return interpreter.evaluate()
+
+
+def load(fp,lexer=DEFAULT_LEXER,cache=None,optimize=True,field_workers=None,field_pool="thread",budget=None,lazy=False,select=None):
+    return loads(fp.read(),lexer,cache,optimize,field_workers,field_pool,budget,lazy,select)
+
+
+def dumps(obj):
+    if type(obj) in LAZY_TYPES:
+        # the fields read so far are not evaluated again
+        return obj.interpreter.render(obj.node)
+    return value_to_json(obj)
+
+
+def execute_stream(file_path,chunk_size=STREAM_CHUNK_SIZE,optimize=True,budget=None):
+    with open(file_path,"r") as jsonx_file:
+        with trace_phase("lex"):
+            referenced = this_references(StreamLexer(jsonx_file,chunk_size))
+        jsonx_file.seek(0)
+        parser = Parser(TokenWindow(StreamLexer(jsonx_file,chunk_size)))
+        node_type,members = parser.parse_stream()
+        if optimize:
+            members = folded_members(node_type,members)
+        interpreter = Interpreter(None,budget=budget)
+
+        # reading, lexing, parsing and writing are interleaved here, so all of it counts as interpret
+        with trace_phase("interpret"):
+            with replaced_file(get_json_file_name(file_path),OUTPUT_BUFFER_SIZE) as json_file:
+                interpreter.interp_stream(node_type,members,json_file,referenced)
+
+
+def folded_members(node_type,members):
+    # constant folding a top level member at a time, as the stream reaches it
+    folder = ConstantFolder()
+    for index,member in enumerate(members):
+        if type(member) == NameValuePairNode:
+            if type(member.value_token) == FuncDefNode:
+                member.value_token = folder.fold_function(member.value_token,(ROOT_LABEL,member.name.string))
+            else:
+                folder.fold(member.value_token)
+        elif type(member) == FuncDefNode:
+            member = folder.fold_function(member,(ROOT_LABEL,index))
+        else:
+            folder.fold(member)
+        yield member
+
+
+#### TEMPLATES ####
+
+# characters of JSON Lines read per batch, and the buffer of the files a template reads and writes
+TEMPLATE_BATCH_SIZE = 1 << 20
+TEMPLATE_BUFFER_SIZE = 1 << 20
+RECORD_DECODER = json.JSONDecoder(parse_constant=reject_constant)
+
+
+class Template:
+    # a .jsonx object parsed and compiled once, then applied to many records: each record is bound as this,
+    # and the template's fields are added to it, replacing record fields of the same name
+    def __init__(self,source,lexer=DEFAULT_LEXER,optimize=True,budget=None):
+        ast = parse_text(source,lexer,None,optimize)
+        if type(ast) not in (ObjectNode,RawNode) or type(ast) == RawNode and ast.text.lstrip()[:1] != "{":
+            raise Exception("A template must be a JSON object")
+
+        self.budget = budget
+        self.interpreter = Interpreter(ast,budget=budget)
+        self.functions = []
+        self.members = {}
+        self.fields = []
+        if type(ast) == RawNode:
+            # a template without functions only adds its fields
+            for name,value in ast.value().items():
+                self.members[name] = value
+                self.fields.append((name,value,False))
+            return
+
+        plan = EvaluationPlan(ast)
+        # only the top level fields see the record, nested objects are evaluated once like any document;
+        # the fields are compiled here and run in plan order through evaluate_function, so a field reading
+        # the whole of this leaves itself out like it does in a document
+        self.functions = [func_node for func_node in plan.order if plan.owners[id(func_node)] is ast]
+        for func_node in self.functions:
+            self.interpreter.compile_function(func_node)
+        for key,member in zip(ast.keys,ast.values):
+            name = decode_string(key)
+            if type(member) == FuncDefNode:
+                self.members[name] = member
+                self.fields.append((name,member,True))
+            else:
+                # static values are shared by every record
+                value = self.interpreter.to_python(member)
+                self.members[name] = value
+                self.fields.append((name,value,False))
+
+    def apply(self,record):
+        if type(record) != dict:
+            raise Exception("A record must be a JSON object, not {}".format(VALUE_TYPE_NAMES.get(type(record),"value")))
+        interpreter = self.interpreter
+        interpreter.function_results = results = {}
+        if self.budget is not None:
+            self.budget.start()
+
+        context = ObjectContext()
+        context.members = dict(record)
+        context.members.update(self.members)
+        for func_node in self.functions:
+            interpreter.evaluate_function(func_node,context)
+        for name,value,is_function in self.fields:
+            record[name] = results[id(value)] if is_function else value
+        return record
+
+    def apply_lines(self,lines,first_line=1):
+        output = []
+        for line_number,line in enumerate(lines,first_line):
+            if not line.strip():
+                continue
+            try:
+                output.append(value_to_json(self.apply(RECORD_DECODER.decode(line))))
+            except Exception as error:
+                raise Exception("Line {}: {}".format(line_number,error))
+        return output
+
+    def run(self,input,output,batch_size=TEMPLATE_BATCH_SIZE):
+        # JSON Lines in, JSON Lines out, read and written a batch of lines at a time; returns the number of records
+        records = 0
+        line_number = 1
+        with trace_phase("interpret"):
+            while True:
+                lines = input.readlines(batch_size)
+                if not lines:
+                    break
+                batch = self.apply_lines(lines,line_number)
+                line_number += len(lines)
+                records += len(batch)
+                if batch:
+                    output.write("\n".join(batch) + "\n")
+        trace_count("interpret",records)
+        return records
+
+
+def load_template(file_path,lexer=DEFAULT_LEXER,optimize=True,budget=None):
+    with open(file_path,"r") as template_file:
+        with trace_phase("read"):
+            source = template_file.read()
+    return Template(source,lexer,optimize,budget)
+
+
+def execute_records(template,input_paths=None,output=None,batch_size=TEMPLATE_BATCH_SIZE):
+    # applies a template to JSON Lines files, or to stdin when there are none, and writes to output or stdout
+    if not isinstance(template,Template):
+        template = load_template(template)
+    close_output = output is None
+    if output is None:
+        output = open(sys.stdout.fileno(),"w",encoding="utf-8",buffering=TEMPLATE_BUFFER_SIZE,closefd=False)
+    records = 0
+    try:
+        if not input_paths:
+            with open(sys.stdin.fileno(),"r",encoding="utf-8",buffering=TEMPLATE_BUFFER_SIZE,closefd=False) as input:
+                records += template.run(input,output,batch_size)
+        for path in input_paths or ():
+            with open(path,"r",encoding="utf-8",buffering=TEMPLATE_BUFFER_SIZE) as input:
+                records += template.run(input,output,batch_size)
+    finally:
+        if close_output:
+            output.close()
+        else:
+            output.flush()
+    return records
+
+
+#### BATCH EXECUTION ####
+
+class FileResult:
+    def __init__(self,path,json_path=None,error=None):
+        self.path = path
+        self.json_path = json_path
+        self.error = error
+        # per-phase [seconds, calls, items] when the batch is profiled
+        self.phases = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.error:
+            return "FileResult({}, error={!r})".format(self.path,self.error)
+        return "FileResult({} -> {})".format(self.path,self.json_path)
+
+
+def expand_paths(paths_or_globs):
+    if isinstance(paths_or_globs,str):
+        paths_or_globs = [paths_or_globs]
+    paths = []
+    seen = set()
+    for pattern in paths_or_globs:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern,"**","*.jsonx"),recursive=True))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern,recursive=True))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def execute_file(path,options):
+    options = dict(options)
+    file_tracer = None
+    if options.pop("profile",False):
+        file_tracer = Tracer(tracer.level if tracer is not None else TRACE_SILENT,tracer.output if tracer is not None else None)
+
+    try:
+        if file_tracer is None:
+            execute(path,**options)
+        else:
+            with tracing(file_tracer):
+                execute(path,**options)
+    except Exception as error:
+        result = FileResult(path,error="{}: {}".format(type(error).__name__,error))
+    else:
+        result = FileResult(path,get_json_file_name(path))
+
+    if file_tracer is not None:
+        result.phases = file_tracer.phases
+        if tracer is not None:
+            tracer.merge(file_tracer.phases)
+    return result
+
+
+def execute_chunk(paths,options):
+    return [execute_file(path,options) for path in paths]
+
+
+def execute_many(paths_or_globs,workers=None,lexer=DEFAULT_LEXER,stream=False,cache=None,profile=False,field_workers=None,field_pool="thread",budget=None,select=None):
+    paths = expand_paths(paths_or_globs)
+    options = {"lexer": lexer, "stream": stream, "cache": cache, "profile": profile}
+    if field_workers is not None:
+        options["field_workers"] = field_workers
+        options["field_pool"] = field_pool
+    if budget is not None:
+        # every file starts the budget over
+        options["budget"] = budget
+    if select is not None:
+        options["select"] = select
+    if isinstance(cache,DocumentCache):
+        options["cache"] = cache.directory
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(paths) < 2:
+        return execute_chunk(paths,options)
+
+    # a few chunks per worker keeps the pool busy without a round trip per file
+    chunk_size = max(1,-(-len(paths) // (workers * 4)))
+    chunks = [paths[index:index+chunk_size] for index in range(0,len(paths),chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_results in executor.map(execute_chunk,chunks,[options]*len(chunks)):
+            results.extend(chunk_results)
+    return results
+
+
+def main(argv=None):
+    argument_parser = argparse.ArgumentParser(prog="jsonx",description="Execute .jsonx files and write the .json next to them.")
+    argument_parser.add_argument("paths",nargs="*",help=".jsonx files, directories or glob patterns; with --template, JSON Lines files (default: stdin)")
+    argument_parser.add_argument("-w","--workers",type=int,default=None,help="worker processes (default: number of CPUs)")
+    argument_parser.add_argument("--lexer",choices=sorted(LEXERS),default=DEFAULT_LEXER)
+    argument_parser.add_argument("--stream",action="store_true",help="process each file in streaming mode")
+    argument_parser.add_argument("--cache",default=None,help="directory of the parsed document cache")
+    argument_parser.add_argument("--profile",action="store_true",help="print the time spent reading, lexing, parsing, interpreting and writing")
+    argument_parser.add_argument("--field-workers",type=int,default=None,help="evaluate independent function fields of a file on this many workers")
+    argument_parser.add_argument("--field-pool",choices=FIELD_POOLS,default="thread",help="run function fields on threads or processes (default: thread)")
+    argument_parser.add_argument("--max-steps",type=int,default=None,help="stop a file after this many loop iterations and function fields")
+    argument_parser.add_argument("--max-output",type=int,default=None,help="stop a file whose output grows past this many characters")
+    argument_parser.add_argument("--timeout",type=float,default=None,help="stop evaluating a file after this many seconds")
+    argument_parser.add_argument("--select",default=None,help="write only the value at this path, such as a.b[3].c, evaluating just what it needs")
+    argument_parser.add_argument("--template",default=None,help="apply this .jsonx template to every JSON Lines record and write JSON Lines to stdout")
+    arguments = argument_parser.parse_args(argv)
+
+    budget = None
+    if arguments.max_steps is not None or arguments.max_output is not None or arguments.timeout is not None:
+        budget = Budget(arguments.max_steps,arguments.max_output,arguments.timeout)
+    if arguments.template is not None:
+        return main_template(arguments,budget)
+    if not arguments.paths:
+        argument_parser.error("the following arguments are required: paths")
+    results = execute_many(arguments.paths,arguments.workers,arguments.lexer,arguments.stream,arguments.cache,arguments.profile,arguments.field_workers,arguments.field_pool,budget,arguments.select)
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        print("{}: {}".format(result.path,result.error),file=sys.stderr)
+    print("{} files, {} failed".format(len(results),len(failed)),file=sys.stderr)
+    if arguments.profile:
+        profile = Tracer(TRACE_SILENT)
+        for result in results:
+            if result.phases:
+                profile.merge(result.phases)
+        for line in profile.report():
+            print(line,file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main_template(arguments,budget):
+    profile = Tracer(TRACE_SILENT) if arguments.profile else None
+    start = time.perf_counter()
+    try:
+        with tracing(profile) if profile is not None else NO_PHASE:
+            template = load_template(arguments.template,arguments.lexer,budget=budget)
+            records = execute_records(template,arguments.paths)
+    except Exception as error:
+        print("{}: {}".format(arguments.template,error),file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print("{} records in {:.3f}s ({:.0f} records/s)".format(records,elapsed,records / elapsed if elapsed else 0),file=sys.stderr)
+    if profile is not None:
+        for line in profile.report():
+            print(line,file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())